@@ -0,0 +1,378 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+import uuid
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from cachetools import LRUCache, TTLCache
+
+from app.config import settings
+from app.db.redis import get_redis
+from app.services import klingo
+from app.services.resilience import detach_budget, join_timeout
+from app.utils.filters import filter_slots
+from app.utils.metrics import histogram
+from app.utils.singleflight import SingleFlight
+from app.utils.slots import SlotStore
+
+__all__ = [
+    "AgendaKey",
+    "DEFAULT_AGENDA_KEY",
+    "parse_agenda_key",
+    "get_reduced_agenda_cached",
+    "refresh_agenda",
+    "prefetch_agendas",
+    "warm_in_background",
+    "slot_store_for",
+    "start_refresher",
+    "stop_refreshers",
+    "invalidate_slot",
+    "start_invalidation_listener",
+    "agenda_flight_stats",
+    "encode_reduced",
+    "decode_reduced",
+]
+
+AgendaKey = Tuple[str, str, str]  # (especialidade, exame, plano)
+DEFAULT_AGENDA_KEY: AgendaKey = ("225275", "1376", "1")
+
+
+def parse_agenda_key(raw: str) -> AgendaKey:
+    """"225275:1376:1" -> ("225275", "1376", "1")"""
+    parts = [p.strip() for p in raw.split(":")]
+    if len(parts) != 3 or not all(parts):
+        raise ValueError(f"Consulta de agenda inválida: {raw!r} (use especialidade:exame:plano)")
+    return parts[0], parts[1], parts[2]
+
+
+# -----------------------------------------------------------------------------
+# Cache (reduz custo de API): agenda reduzida por consulta, LRU + TTL
+# -----------------------------------------------------------------------------
+_agenda_cache: TTLCache = TTLCache(
+    maxsize=settings.agenda_cache_maxsize, ttl=settings.agenda_cache_ttl_seconds
+)
+# misses concorrentes da mesma consulta compartilham uma única busca na Klingo
+_agenda_flight = SingleFlight()
+# última agenda obtida com sucesso por chave (monotonic, agenda) — base do modo SWR
+_last_good: LRUCache = LRUCache(maxsize=settings.agenda_cache_maxsize)
+# índice de slots de cada agenda, construído uma vez por refresh
+_stores: LRUCache = LRUCache(maxsize=settings.agenda_cache_maxsize)
+_refreshers: Dict[AgendaKey, asyncio.Task] = {}
+_background: Set[asyncio.Task] = set()  # prefetches especulativos (referência evita GC)
+# slots já agendados: removidos de toda agenda carregada enquanto a Klingo pode não refletir
+_booked: TTLCache = TTLCache(maxsize=4096, ttl=settings.agenda_booked_ttl_seconds)
+_listener: Optional[asyncio.Task] = None
+_filter_latency = histogram(
+    "otinho_filter_slots_seconds", "Tempo de filter_slots por agenda",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+# -----------------------------------------------------------------------------
+# Tier Redis (compartilhado entre workers): forma compacta, chave versionada e
+# lock para que só um nó busque na Klingo. Sem Redis, fica só o cache local.
+# -----------------------------------------------------------------------------
+AGENDA_CACHE_VERSION = 1  # incremente ao mudar o formato serializado
+_REDIS_PREFIX = f"otinho:agenda:v{AGENDA_CACHE_VERSION}"
+_BOOKED_CHANNEL = f"{_REDIS_PREFIX}:booked"  # pub/sub de slots agendados entre workers
+_RELEASE_LOCK = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+)
+
+
+def _redis_key(key: AgendaKey) -> str:
+    horizon = "full" if settings.agenda_full_horizon else "top"
+    return f"{_REDIS_PREFIX}:{horizon}:{':'.join(key)}"
+
+
+def encode_reduced(reduced: Dict[str, Any]) -> bytes:
+    """{"doctors": ...} -> JSON em listas posicionais, comprimido (zlib)."""
+    compact = [
+        [
+            did,
+            d["doctor_name"],
+            [[e["date"], [[t["slot_id"], t["time"]] for t in e["times"]]] for e in d["dates"]],
+        ]
+        for did, d in reduced.get("doctors", {}).items()
+    ]
+    raw = json.dumps(compact, separators=(",", ":"), ensure_ascii=False)
+    return zlib.compress(raw.encode("utf-8"))
+
+
+def decode_reduced(blob: bytes) -> Dict[str, Any]:
+    compact = json.loads(zlib.decompress(blob))
+    return {
+        "doctors": {
+            did: {
+                "doctor_name": name,
+                "dates": [
+                    {"date": d, "times": [{"slot_id": sid, "time": t} for sid, t in times]}
+                    for d, times in dates
+                ],
+            }
+            for did, name, dates in compact
+        }
+    }
+
+
+async def _fetch_from_klingo(key: AgendaKey) -> Dict[str, Any]:
+    payload = await klingo.get_agenda(*key)
+    t0 = time.perf_counter()
+    # já filtra hoje, domingos e feriados; top 3 datas / 5 horários, ou tudo no modo full
+    if settings.agenda_full_horizon:
+        reduced = filter_slots(payload, max_dates=None, max_times=None)
+    else:
+        reduced = filter_slots(payload)
+    _filter_latency.observe(time.perf_counter() - t0)
+    return reduced
+
+
+async def _wait_for_peer(r: Any, rkey: str) -> Optional[bytes]:
+    deadline = time.monotonic() + settings.agenda_redis_wait_seconds
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+        blob = await r.get(rkey)
+        if blob is not None:
+            return blob
+    return None
+
+
+async def _fetch_shared(key: AgendaKey) -> Dict[str, Any]:
+    r = await get_redis()
+    if r is None:
+        return await _fetch_from_klingo(key)
+
+    rkey = _redis_key(key)
+    token = uuid.uuid4().hex
+    blob, locked = None, False
+    try:
+        blob = await r.get(rkey)
+        if blob is None:
+            locked = bool(await r.set(
+                rkey + ":lock", token, nx=True, px=int(settings.agenda_redis_lock_seconds * 1000)
+            ))
+            if not locked:
+                # outro worker está buscando: aguarda ele publicar
+                blob = await _wait_for_peer(r, rkey)
+    except Exception:
+        # Redis indisponível: segue só com o cache local
+        blob, locked = None, False
+
+    if blob is not None:
+        return decode_reduced(blob)
+    if not locked:
+        return await _fetch_from_klingo(key)
+
+    try:
+        reduced = await _fetch_from_klingo(key)
+        try:
+            await r.set(rkey, encode_reduced(reduced), ex=settings.agenda_cache_ttl_seconds)
+        except Exception:
+            pass
+        return reduced
+    finally:
+        try:
+            await r.eval(_RELEASE_LOCK, 1, rkey + ":lock", token)
+        except Exception:
+            pass
+
+
+async def _fetch_reduced(key: AgendaKey) -> Dict[str, Any]:
+    reduced = await _fetch_shared(key)
+    store = SlotStore.from_reduced(reduced)
+    for slot_id in list(_booked):
+        store.remove(slot_id)
+    _stores[key] = store
+    _agenda_cache[key] = reduced
+    _last_good[key] = (time.monotonic(), reduced)
+    return reduced
+
+
+async def refresh_agenda(key: AgendaKey = DEFAULT_AGENDA_KEY) -> Dict[str, Any]:
+    """Ignora o cache local e busca a agenda (Redis, senão Klingo), coalescendo buscas."""
+    try:
+        # a busca pode ter sido iniciada pelo prefetch (sem prazo): o turno não espera além do seu
+        return await _agenda_flight.do(key, lambda: _fetch_reduced(key), timeout=join_timeout())
+    except (asyncio.TimeoutError, TimeoutError) as e:
+        raise klingo.KlingoError(504, f"timeout: {e}") from e
+
+
+async def prefetch_agendas(keys: Optional[Iterable[AgendaKey]] = None) -> List[Any]:
+    """
+    Aquece o cache das combinações populares em paralelo (padrão: agenda_prefetch_queries).
+    Falhas são devolvidas na lista, sem interromper as demais buscas.
+    """
+    if keys is None:
+        keys = [parse_agenda_key(q) for q in settings.agenda_prefetch_queries] or [DEFAULT_AGENDA_KEY]
+    keys = list(dict.fromkeys(keys))
+    if settings.agenda_swr_enabled:
+        for key in keys:
+            start_refresher(key)
+    return await asyncio.gather(*(refresh_agenda(k) for k in keys), return_exceptions=True)
+
+
+async def _refresh_loop(key: AgendaKey) -> None:
+    detach_budget()
+    while True:
+        await asyncio.sleep(settings.agenda_refresh_interval_seconds)
+        try:
+            await refresh_agenda(key)
+        except Exception:
+            # mantém a última agenda; o limite de staleness protege os chamadores
+            pass
+
+
+def start_refresher(key: AgendaKey = DEFAULT_AGENDA_KEY) -> None:
+    """Garante um refresher em background para a chave (no event loop atual)."""
+    task = _refreshers.get(key)
+    if task is None or task.done():
+        _refreshers[key] = asyncio.get_running_loop().create_task(_refresh_loop(key))
+
+
+def _is_warm(key: AgendaKey) -> bool:
+    if settings.agenda_swr_enabled:
+        last = _last_good.get(key)
+        return bool(last) and time.monotonic() - last[0] <= settings.agenda_max_stale_seconds
+    return key in _agenda_cache
+
+
+def _forget_background(task: asyncio.Task) -> None:
+    _background.discard(task)
+    if not task.cancelled():
+        task.exception()  # falha no prefetch não afeta o turno; o step busca de novo
+
+
+async def _warm(key: AgendaKey) -> None:
+    detach_budget()
+    await get_reduced_agenda_cached(*key)
+
+
+def warm_in_background(key: AgendaKey = DEFAULT_AGENDA_KEY) -> None:
+    """
+    Dispara, sem aguardar, o aquecimento da agenda da consulta. Não faz nada se
+    o cache já está quente ou se há busca em andamento (single-flight).
+    """
+    if _is_warm(key) or _agenda_flight.in_flight(key):
+        return
+    task = asyncio.get_running_loop().create_task(_warm(key))
+    _background.add(task)
+    task.add_done_callback(_forget_background)
+
+
+async def stop_refreshers() -> None:
+    global _listener
+    tasks = [*_refreshers.values(), *_background, *([_listener] if _listener else [])]
+    _refreshers.clear()
+    _listener = None
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def get_reduced_agenda_cached(
+    especialidade: str = "225275", exame: str = "1376", plano: str = "1"
+) -> Dict[str, Any]:
+    """
+    Busca agenda na Klingo e aplica filtro de regras. Usa cache TTL + single-flight,
+    atrás de um tier Redis compartilhado quando redis_url está configurado.
+    Com agenda_swr_enabled, devolve a última agenda na hora e deixa o refresh
+    para o background; só bloqueia se ela passar de agenda_max_stale_seconds.
+    """
+    key = (especialidade, exame, plano)
+
+    if settings.agenda_swr_enabled:
+        start_refresher(key)
+        last = _last_good.get(key)
+        if last and time.monotonic() - last[0] <= settings.agenda_max_stale_seconds:
+            return last[1]
+    elif key in _agenda_cache:
+        return _agenda_cache[key]
+
+    try:
+        return await refresh_agenda(key)
+    except klingo.KlingoError:
+        # Klingo fora do ar (ou circuito aberto): a última agenda é melhor que nada
+        last = _last_good.get(key)
+        if last:
+            return last[1]
+        raise
+
+
+# -----------------------------------------------------------------------------
+# Invalidação de slots agendados (local + Redis pub/sub para os demais workers)
+# -----------------------------------------------------------------------------
+def _drop_local(slot_id: str) -> List[AgendaKey]:
+    """Remove o slot das agendas em memória; devolve as chaves alteradas."""
+    _booked[slot_id] = True
+    # store.source é o mesmo objeto em _agenda_cache/_last_good: remove de todos
+    return [key for key, store in list(_stores.items()) if store.remove(slot_id)]
+
+
+async def invalidate_slot(slot_id: str) -> None:
+    """
+    Tira um slot recém-agendado do cache, para que não seja oferecido a outro
+    paciente até o próximo refresh. Com Redis, atualiza o tier compartilhado e
+    avisa os outros workers.
+    """
+    touched = _drop_local(slot_id)
+    r = await get_redis()
+    if r is None:
+        return
+    try:
+        for key in touched:
+            reduced = _agenda_cache.get(key) or _stores[key].source
+            await r.set(_redis_key(key), encode_reduced(reduced), xx=True, keepttl=True)
+        await r.publish(_BOOKED_CHANNEL, slot_id)
+    except Exception:
+        # sem Redis os demais workers só veem a mudança no próximo refresh
+        pass
+
+
+async def _listen_invalidations() -> None:
+    detach_budget()
+    while True:
+        r = await get_redis()
+        if r is None:
+            return
+        pubsub = r.pubsub()
+        try:
+            await pubsub.subscribe(_BOOKED_CHANNEL)
+            async for msg in pubsub.listen():
+                if msg.get("type") != "message":
+                    continue
+                data = msg["data"]
+                _drop_local(data.decode("utf-8") if isinstance(data, bytes) else str(data))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await asyncio.sleep(1.0)  # conexão caiu: assina de novo
+        finally:
+            try:
+                await pubsub.reset()
+            except Exception:
+                pass
+
+
+def start_invalidation_listener() -> None:
+    """Assina as invalidações dos outros workers (no event loop atual; sem Redis, nada)."""
+    global _listener
+    if not settings.redis_url:
+        return
+    if _listener is None or _listener.done():
+        _listener = asyncio.get_running_loop().create_task(_listen_invalidations())
+
+
+def slot_store_for(reduced: Dict[str, Any]) -> SlotStore:
+    """Índice da agenda informada: reaproveita o do refresh, senão constrói um novo."""
+    for store in _stores.values():
+        if store.source is reduced:
+            return store
+    return SlotStore.from_reduced(reduced)
+
+
+def agenda_flight_stats() -> Dict[str, Any]:
+    """Métricas do single-flight da agenda (chamadas, buscas reais, coalescidas)."""
+    return _agenda_flight.stats()
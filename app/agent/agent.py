@@ -1,28 +1,38 @@
 from __future__ import annotations
 
 import re
+import time
 from typing import Dict, Any, Tuple, Optional
 
-from cachetools import TTLCache
-
 from app.security.guardrails import looks_like_injection
-from app.agent.state import AgentVars
-from app.services import klingo
-from app.services.asaas import create_payment_link
+from app.agent.state import AgentVars, Step
+from app.agent.fsm import StepTable
+from app.agent import nlu
+from app.agent.agenda import (
+    get_reduced_agenda_cached,
+    agenda_flight_stats,
+    refresh_agenda,
+    slot_store_for,
+    invalidate_slot,
+    warm_in_background,
+)
+from app.services import appointments, klingo, patients
+from app.services.asaas import AsaasError, create_payment_link
+from app.services.resilience import turn_budget
+from app.config import settings
 from app.utils.validators import (
     sanitize_digits,
     is_valid_phone,
     is_valid_cpf,
     to_iso_date,
 )
-from app.utils.filters import filter_slots
+from app.utils.matcher import DoctorMatcher
+from app.utils.metrics import histogram
+from app.utils.slots import SlotStore
 
-__all__ = ["agent_controller"]
+__all__ = ["agent_controller", "agenda_flight_stats", "nlu_tier_stats", "steps"]
 
-# -----------------------------------------------------------------------------
-# Cache (reduz custo de API): agenda reduzida por 60s
-# -----------------------------------------------------------------------------
-_agenda_cache: TTLCache = TTLCache(maxsize=1, ttl=60)
+nlu_tier_stats = nlu.tier_stats
 
 # -----------------------------------------------------------------------------
 # Helpers de parsing e formatação
@@ -53,10 +63,13 @@ def iso_to_br(date_iso: str) -> str:
     return f"{d}/{m}/{y}"
 
 
-def extract_doctor(text: str, doctors: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+def extract_doctor(
+    text: str, doctors: Dict[str, Any], matcher: Optional[DoctorMatcher] = None
+) -> Optional[Tuple[str, str]]:
     """
-    Seleciona médico por id (se usuário digitar) ou por substring do nome.
+    Seleciona médico por id (se usuário digitar) ou pelo nome via índice de nomes.
     Nunca exibimos/solicitamos ids, mas aceitamos se o usuário enviar.
+    Menção ambígua (ex.: primeiro nome de dois médicos) retorna None.
     """
     txt = normalize(text)
 
@@ -65,20 +78,11 @@ def extract_doctor(text: str, doctors: Dict[str, Any]) -> Optional[Tuple[str, st
         if mid in doctors:
             return mid, doctors[mid]["doctor_name"]
 
-    # Por nome (substring), tolerando "dr"/"dra"
-    for did, d in doctors.items():
-        name = normalize(d["doctor_name"])
-        name_clean = (
-            name.replace("dr ", "")
-            .replace("dra ", "")
-            .replace("dr.", "")
-            .replace("dra.", "")
-        )
-        if name in txt or name_clean in txt:
-            return did, d["doctor_name"]
-        if any(part and part in name for part in txt.split()):
-            return did, d["doctor_name"]
-
+    # Por nome (sem acentos, tolerando "dr"/"dra")
+    matcher = matcher or DoctorMatcher.from_doctors(doctors)
+    did = matcher.match(text)
+    if did and did in doctors:
+        return did, doctors[did]["doctor_name"]
     return None
 
 
@@ -94,6 +98,29 @@ def extract_date(text: str) -> Optional[str]:
     return to_iso_date(m.group(1))
 
 
+PHONE_RUN_RE = re.compile(r"\+?\d[\d\s().-]{8,}\d")
+
+
+def extract_phone(text: str) -> Optional[str]:
+    """Telefone (11+ dígitos) citado na mensagem, ignorando datas e horários."""
+    rest = TIME_RE.sub(" ", DATE_RE_BR.sub(" ", DATE_RE_ISO.sub(" ", text or "")))
+    for run in PHONE_RUN_RE.findall(rest):
+        digits = sanitize_digits(run)
+        if is_valid_phone(digits) and len(digits) <= 13:
+            return digits
+    return None
+
+
+def extract_birthday(text: str) -> Optional[str]:
+    """Data de nascimento só quando o paciente a identifica como tal ("nasci em ...")."""
+    if "nasc" not in normalize(text):
+        return None
+    try:
+        return extract_date(text)
+    except ValueError:
+        return None
+
+
 def extract_time(text: str) -> Optional[str]:
     mt = TIME_RE.search(text)
     if not mt:
@@ -111,6 +138,19 @@ def parse_sex(text: str) -> Optional[str]:
     return None
 
 
+async def resolve_doctor(
+    text: str, doctors: Dict[str, Any], matcher: DoctorMatcher
+) -> Optional[Tuple[str, str]]:
+    """extract_doctor; sem resultado ou com empate, pergunta ao LLM (entre os empatados)."""
+    async def ask_llm(t: str) -> Optional[Tuple[str, str]]:
+        tied = [d for d in matcher.candidates(t) if d in doctors]
+        pool = tied if len(tied) > 1 else list(doctors)
+        did = await nlu.llm_doctor(t, {d: doctors[d]["doctor_name"] for d in pool})
+        return (did, doctors[did]["doctor_name"]) if did else None
+
+    return await nlu.tiered("doctor", text, lambda t: extract_doctor(t, doctors, matcher), ask_llm)
+
+
 def bullets(title: str, items: list[str]) -> str:
     if not items:
         return title + "\n- (sem opções disponíveis)"
@@ -121,16 +161,6 @@ def bullets(title: str, items: list[str]) -> str:
 # -----------------------------------------------------------------------------
 # Agenda & slots (com filtro de regras de negócio)
 # -----------------------------------------------------------------------------
-async def get_reduced_agenda_cached() -> Dict[str, Any]:
-    """Busca agenda na Klingo e aplica filtro de regras. Usa cache TTL."""
-    if "reduced" in _agenda_cache:
-        return _agenda_cache["reduced"]
-    payload = await klingo.get_agenda()
-    reduced = filter_slots(payload)  # já filtra hoje, domingos e feriados; top 3 datas / 5 horários
-    _agenda_cache["reduced"] = reduced
-    return reduced
-
-
 def render_doctor_options(doctors: Dict[str, Any]) -> str:
     names = [d["doctor_name"] for _, d in doctors.items()]
     # remove duplicados preservando ordem
@@ -138,24 +168,53 @@ def render_doctor_options(doctors: Dict[str, Any]) -> str:
     return bullets("Médicos:", names[:10])
 
 
-def list_dates_for_doc(doc: Dict[str, Any]) -> list[str]:
-    return [iso_to_br(e["date"]) for e in doc.get("dates", [])][:3]
+def slot_store(state: AgentVars) -> SlotStore:
+    """Índice de slots da agenda da sessão (compartilhado com o cache quando possível)."""
+    store = state._slot_store
+    if store is None or store.source is not state.agenda_reduced:
+        store = slot_store_for(state.agenda_reduced)
+        state._slot_store = store
+    return store
 
 
-def list_times_for_doc_date(doc: Dict[str, Any], date_iso: str) -> list[str]:
-    for e in doc.get("dates", []):
-        if e["date"] == date_iso:
-            return [t["time"] for t in e.get("times", [])][:5]
-    return []
+DATES_PAGE = 3
+TIMES_PAGE = 5
+MORE_DATES_WORDS = (
+    "mais datas", "outras datas", "outra data", "outro dia", "outros dias",
+    "proximas datas", "próximas datas",
+)
+MORE_TIMES_WORDS = (
+    "mais tarde", "mais horarios", "mais horários", "outros horarios", "outros horários",
+    "outro horario", "outro horário", "proximos horarios", "próximos horários",
+)
 
 
-def find_slot_id(doc: Dict[str, Any], date_iso: str, time_: str) -> Optional[str]:
-    for e in doc.get("dates", []):
-        if e["date"] == date_iso:
-            for t in e.get("times", []):
-                if t["time"] == time_:
-                    return t["slot_id"]
-    return None
+def wants_more_dates(t: str) -> bool:
+    n = normalize(t)
+    return any(w in n for w in MORE_DATES_WORDS)
+
+
+def wants_more_times(t: str) -> bool:
+    n = normalize(t)
+    return any(w in n for w in MORE_TIMES_WORDS)
+
+
+def next_offset(total: int, offset: int, page: int) -> Optional[int]:
+    nxt = offset + page
+    return nxt if nxt < total else None
+
+
+def list_dates_for_doc(store: SlotStore, doctor_id: str, offset: int = 0) -> list[str]:
+    return [iso_to_br(d) for d in store.dates(doctor_id)[offset:offset + DATES_PAGE]]
+
+
+def list_times_for_doc_date(store: SlotStore, doctor_id: str, date_iso: str, offset: int = 0) -> list[str]:
+    return store.times(doctor_id, date_iso)[offset:offset + TIMES_PAGE]
+
+
+def find_slot_id(store: SlotStore, doctor_id: str, date_iso: str, time_: str) -> Optional[str]:
+    slot = store.find(doctor_id, date_iso, time_)
+    return slot.slot_id if slot else None
 
 
 # -----------------------------------------------------------------------------
@@ -167,101 +226,170 @@ GREETING = (
 )
 
 # -----------------------------------------------------------------------------
-# Steps da FSM
+# Steps da FSM (registrados na tabela de despacho)
 # -----------------------------------------------------------------------------
-async def step_start(state: AgentVars) -> str:
-    state.current_step = "ASK_DOCTOR_PREFERENCE"
+steps = StepTable(fallback=Step.END)
+
+
+@steps.step(Step.START)
+async def step_start(state: AgentVars, user_text: str = "") -> str:
+    state.current_step = Step.ASK_DOCTOR_PREFERENCE
     return GREETING
 
 
+@steps.step(Step.ASK_DOCTOR_PREFERENCE)
 async def step_ask_doctor_preference(state: AgentVars, user_text: str) -> str:
     txt = normalize(user_text)
 
-    reduced = await get_reduced_agenda_cached()
+    reduced = await get_reduced_agenda_cached(state.especialidade, state.exame, state.plano)
     doctors = reduced.get("doctors", {})
     state.agenda_reduced = reduced
     state.doctors_cache = doctors
 
     # Não tem preferência
     if is_no(user_text) or "primeira vez" in txt or "sem preferência" in txt or "sem preferencia" in txt:
-        state.current_step = "ASK_DOCTOR"
+        state.current_step = Step.ASK_DOCTOR
         return f"{render_doctor_options(doctors)}\n\nQual médico você prefere?"
 
     # Informou um nome (ou id por conta própria)
-    choice = extract_doctor(user_text, doctors)
+    choice = await nlu.tiered(
+        "doctor", user_text, lambda t: extract_doctor(t, doctors, slot_store(state).matcher)
+    )
     if choice:
         did, dname = choice
         state.doctor_id, state.doctor_name = did, dname
-        doc = doctors[did]
-        dates = list_dates_for_doc(doc)
-        state.current_step = "ASK_DATE"
+        state.dates_offset = 0
+        dates = list_dates_for_doc(slot_store(state), did)
+        state.current_step = Step.ASK_DATE
         title = f"Datas para {dname}:"
         return f"{bullets(title, dates)}\n\nQual data você prefere?"
 
     # Peça o médico explicitamente
-    state.current_step = "ASK_DOCTOR"
+    state.current_step = Step.ASK_DOCTOR
     return f"{render_doctor_options(doctors)}\n\nQual médico você prefere?"
 
 
+@steps.step(Step.ASK_DOCTOR)
 async def step_ask_doctor(state: AgentVars, user_text: str) -> str:
     doctors = state.doctors_cache or state.agenda_reduced.get("doctors", {})
-    choice = extract_doctor(user_text, doctors)
+    matcher = slot_store(state).matcher
+    choice = await resolve_doctor(user_text, doctors, matcher)
     if not choice:
+        tied = [doctors[d]["doctor_name"] for d in matcher.candidates(user_text) if d in doctors]
+        if len(tied) > 1:
+            return f"{bullets('Encontrei mais de um médico com esse nome:', tied)}\n\nQual deles você prefere?"
         return f"Não identifiquei o médico.\n{render_doctor_options(doctors)}\n\nQual médico você prefere?"
 
     did, dname = choice
     state.doctor_id, state.doctor_name = did, dname
-    doc = doctors[did]
-    dates = list_dates_for_doc(doc)
-    state.current_step = "ASK_DATE"
+    state.dates_offset = 0
+    dates = list_dates_for_doc(slot_store(state), did)
+    state.current_step = Step.ASK_DATE
     title = f"Datas para {dname}:"
     return f"{bullets(title, dates)}\n\nQual data você prefere?"
 
 
+def more_dates_reply(state: AgentVars) -> str:
+    """Próxima página de datas do médico, sem nova chamada à Klingo."""
+    store = slot_store(state)
+    doctor_id = state.doctor_id or ""
+    title = f"Datas para {state.doctor_name}:"
+    nxt = next_offset(len(store.dates(doctor_id)), state.dates_offset, DATES_PAGE)
+    if nxt is None:
+        # fim da lista: recomeça da primeira página em vez de prender o paciente na última
+        note = "Essas eram as últimas datas; voltando às primeiras." if state.dates_offset else (
+            "Não há outras datas disponíveis."
+        )
+        state.dates_offset = 0
+        dates = list_dates_for_doc(store, doctor_id, 0)
+        return f"{note}\n{bullets(title, dates)}\n\nQual data você prefere?"
+    state.dates_offset = nxt
+    dates = list_dates_for_doc(store, doctor_id, nxt)
+    return f"{bullets(title, dates)}\n\nQual data você prefere?"
+
+
+def more_times_reply(state: AgentVars) -> str:
+    """Próxima página de horários da data escolhida, sem nova chamada à Klingo."""
+    store = slot_store(state)
+    doctor_id, date_iso = state.doctor_id or "", state.appoitment_date or ""
+    title = f"Horários em {iso_to_br(date_iso)}:"
+    nxt = next_offset(len(store.times(doctor_id, date_iso)), state.times_offset, TIMES_PAGE)
+    if nxt is None:
+        times = list_times_for_doc_date(store, doctor_id, date_iso, state.times_offset)
+        return (
+            f"Não há horários mais tarde nessa data.\n{bullets(title, times)}\n\n"
+            "Qual horário você prefere? (ou peça outras datas)"
+        )
+    state.times_offset = nxt
+    times = list_times_for_doc_date(store, doctor_id, date_iso, nxt)
+    return f"{bullets(title, times)}\n\nQual horário você prefere?"
+
+
+@steps.step(Step.ASK_DATE)
 async def step_ask_date(state: AgentVars, user_text: str) -> str:
-    date_iso = extract_date(user_text)
+    store = slot_store(state)
+    doctor_id = state.doctor_id or ""
+    paging = wants_more_dates(user_text)
+    date_iso = await nlu.tiered(
+        "date", user_text, extract_date,
+        None if paging else lambda t: nlu.llm_date(t, store.dates(doctor_id)),
+    )
     if not date_iso:
-        doctors = state.doctors_cache or state.agenda_reduced.get("doctors", {})
-        doc = doctors.get(state.doctor_id or "")
-        dates = list_dates_for_doc(doc or {})
+        if paging:
+            return more_dates_reply(state)
+        dates = list_dates_for_doc(store, doctor_id, state.dates_offset)
         title = f"Datas para {state.doctor_name}:"
         return "Por favor, informe a data escolhida.\n" + bullets(title, dates)
 
     state.appoitment_date = date_iso
+    state.times_offset = 0
+    # "outras datas" a partir do ASK_TIME continua da página da data escolhida
+    all_dates = store.dates(doctor_id)
+    if date_iso in all_dates:
+        state.dates_offset = all_dates.index(date_iso) // DATES_PAGE * DATES_PAGE
 
     # Mostra horários da data escolhida
-    doctors = state.doctors_cache or state.agenda_reduced.get("doctors", {})
-    doc = doctors.get(state.doctor_id or "")
-    times = list_times_for_doc_date(doc or {}, date_iso)
-    state.current_step = "ASK_TIME"
+    times = list_times_for_doc_date(store, doctor_id, date_iso)
+    state.current_step = Step.ASK_TIME
     title = f"Horários em {iso_to_br(date_iso)}:"
     return f"{bullets(title, times)}\n\nQual horário você prefere?"
 
 
+@steps.step(Step.ASK_TIME)
 async def step_ask_time(state: AgentVars, user_text: str) -> str:
-    time_ = extract_time(user_text)
+    store = slot_store(state)
+    doctor_id, date_iso = state.doctor_id or "", state.appoitment_date or ""
+    more_dates, more_times = wants_more_dates(user_text), wants_more_times(user_text)
+    time_ = await nlu.tiered(
+        "time", user_text, extract_time,
+        None if more_dates or more_times else lambda t: nlu.llm_time(t, store.times(doctor_id, date_iso)),
+    )
     if not time_:
-        doctors = state.doctors_cache or state.agenda_reduced.get("doctors", {})
-        doc = doctors.get(state.doctor_id or "")
-        times = list_times_for_doc_date(doc or {}, state.appoitment_date or "")
-        title = f"Horários em {iso_to_br(state.appoitment_date or '')}:"
+        if more_dates:
+            state.current_step = Step.ASK_DATE
+            return more_dates_reply(state)
+        if more_times:
+            return more_times_reply(state)
+        times = list_times_for_doc_date(store, doctor_id, date_iso, state.times_offset)
+        title = f"Horários em {iso_to_br(date_iso)}:"
         return "Por favor, escolha um horário válido.\n" + bullets(title, times)
 
-    doctors = state.doctors_cache or state.agenda_reduced.get("doctors", {})
-    doc = doctors.get(state.doctor_id or "")
-    if not doc:
-        state.current_step = "ASK_DOCTOR"
+    if not store.has_doctor(doctor_id):
+        state.current_step = Step.ASK_DOCTOR
         return "Perdi a referência do médico selecionado. Qual médico você prefere?"
 
-    slot_id = find_slot_id(doc, state.appoitment_date or "", time_)
+    slot_id = find_slot_id(store, doctor_id, state.appoitment_date or "", time_)
     if not slot_id:
-        times = list_times_for_doc_date(doc, state.appoitment_date or "")
+        times = list_times_for_doc_date(store, doctor_id, state.appoitment_date or "", state.times_offset)
         title = f"Horários em {iso_to_br(state.appoitment_date or '')}:"
         return "Esse horário não está disponível.\n" + bullets(title, times) + "\n\nQual horário você prefere?"
 
     state.appoitment_hour = time_
     state.appoitment_id = slot_id  # interno (não exibido)
-    state.current_step = "ASK_IDENTIFY"
+    state.current_step = Step.ASK_IDENTIFY
+    if state.user_phone and state.user_birthday_date:
+        # dados já informados: a identificação especulativa provavelmente já terminou
+        return await step_ask_identify(state, "")
     return (
         "Perfeito! Agora, para verificar seu cadastro, me informe:\n"
         "- Data de nascimento (yyyy-mm-dd)\n"
@@ -269,13 +397,14 @@ async def step_ask_time(state: AgentVars, user_text: str) -> str:
     )
 
 
+@steps.step(Step.ASK_IDENTIFY)
 async def step_ask_identify(state: AgentVars, user_text: str) -> str:
     date_iso = extract_date(user_text)
-    phone = sanitize_digits(user_text)
+    phone = extract_phone(user_text)
 
     if date_iso:
         state.user_birthday_date = date_iso
-    if is_valid_phone(phone):
+    if phone:
         state.user_phone = phone
 
     if not state.user_birthday_date:
@@ -283,13 +412,13 @@ async def step_ask_identify(state: AgentVars, user_text: str) -> str:
     if not state.user_phone:
         return "Qual é seu telefone com DDD? (somente números, ex.: 11987654321)"
 
-    # Tenta identificar
+    # Tenta identificar (reaproveita a chamada especulativa, se já disparada)
     try:
-        ident = await klingo.identify_user(state.user_phone, state.user_birthday_date)
+        ident = await patients.identify(state.user_phone, state.user_birthday_date)
         token = ident.get("access_token")
         if token:
             state.user_token = token
-            state.current_step = "ASK_CONFIRM_APPOINTMENT"
+            state.current_step = Step.ASK_CONFIRM_APPOINTMENT
             return (
                 "Cadastro encontrado! Posso confirmar o agendamento?\n"
                 f"- Médico: {state.doctor_name}\n"
@@ -301,7 +430,7 @@ async def step_ask_identify(state: AgentVars, user_text: str) -> str:
         # segue cadastro
         pass
 
-    state.current_step = "ASK_REGISTER"
+    state.current_step = Step.ASK_REGISTER
     return (
         "Não localizei seu cadastro. Por favor, envie:\n"
         "- Nome completo\n"
@@ -310,11 +439,14 @@ async def step_ask_identify(state: AgentVars, user_text: str) -> str:
     )
 
 
+@steps.step(Step.ASK_REGISTER)
 async def step_ask_register(state: AgentVars, user_text: str) -> str:
     # Extrai dados possíveis
     email_match = re.search(r"[\w\.-]+@[\w\.-]+\.\w{2,}", user_text)
     cpf_digits = re.findall(r"\d{11}", user_text)
-    sex_guess = parse_sex(user_text)
+    # LLM só quando a pergunta pendente era o sexo (demais campos já preenchidos)
+    asked_sex = bool(state.user_fullname and state.user_email and state.user_document)
+    sex_guess = await nlu.tiered("sex", user_text, parse_sex, nlu.llm_sex if asked_sex else None)
     name_guess = None
 
     cleaned = re.sub(r"[\w\.-]+@[\w\.-]+\.\w{2,}", "", user_text)
@@ -362,7 +494,9 @@ async def step_ask_register(state: AgentVars, user_text: str) -> str:
         return "Cadastro criado, mas o login falhou. Tente novamente mais tarde, por favor."
 
     state.user_token = token
-    state.current_step = "ASK_CONFIRM_APPOINTMENT"
+    if state.user_phone and state.user_birthday_date:
+        await patients.remember_token(state.user_phone, state.user_birthday_date, token)
+    state.current_step = Step.ASK_CONFIRM_APPOINTMENT
     return (
         "Cadastro criado! Posso confirmar o agendamento?\n"
         f"- Médico: {state.doctor_name}\n"
@@ -372,19 +506,74 @@ async def step_ask_register(state: AgentVars, user_text: str) -> str:
     )
 
 
+def is_slot_conflict(e: klingo.KlingoError) -> bool:
+    """409 respondido pela própria Klingo: horário ocupado. Outros 4xx (payload, permissão do
+    token) não dizem nada do horário e não podem tirá-lo da agenda dos demais workers."""
+    return e.status == 409 and e.__cause__ is None
+
+
+async def slot_rejected_reply(state: AgentVars) -> str:
+    """Klingo recusou o horário: tira do cache (todos os workers) e reoferece os horários atuais."""
+    slot_id = state.appoitment_id or ""
+    await invalidate_slot(slot_id)
+    try:
+        reduced = await refresh_agenda((state.especialidade, state.exame, state.plano))
+        state.agenda_reduced = reduced
+        state.doctors_cache = reduced.get("doctors", {})
+    except klingo.KlingoError:
+        pass  # segue com a agenda da conversa, sem o horário recusado
+    store = slot_store(state)
+    store.remove(slot_id)
+    doctor_id, date_iso = state.doctor_id or "", state.appoitment_date or ""
+    state.appoitment_id = None
+    state.appoitment_hour = None
+    state.times_offset = 0
+
+    times = list_times_for_doc_date(store, doctor_id, date_iso)
+    if not times:
+        state.dates_offset = 0
+        state.current_step = Step.ASK_DATE
+        title = f"Datas para {state.doctor_name}:"
+        dates = list_dates_for_doc(store, doctor_id)
+        return (
+            "Esse horário acabou de ser ocupado e não há outros nessa data.\n"
+            f"{bullets(title, dates)}\n\nQual data você prefere?"
+        )
+    state.current_step = Step.ASK_TIME
+    title = f"Horários em {iso_to_br(date_iso)}:"
+    return f"Esse horário acabou de ser ocupado.\n{bullets(title, times)}\n\nQual horário você prefere?"
+
+
+@steps.step(Step.ASK_CONFIRM_APPOINTMENT)
 async def step_ask_confirm_appointment(state: AgentVars, user_text: str) -> str:
     if is_no(user_text):
-        state.current_step = "END"
+        state.current_step = Step.END
         return "Tudo bem! Se preferir, posso buscar outros horários. É só me dizer. 😊"
     if not is_yes(user_text):
         return "Por favor, responda com 'sim' ou 'não'."
 
     if not (state.user_token and state.appoitment_id):
-        state.current_step = "ASK_IDENTIFY"
+        state.current_step = Step.ASK_IDENTIFY
         return "Estou quase lá! Preciso validar seus dados para prosseguir."
 
-    _ = await klingo.create_appointment(state.user_token, state.appoitment_id)
-    state.current_step = "ASK_PREPAY"
+    try:
+        # idempotente: "sim" repetido ou retry não agenda duas vezes o mesmo horário
+        _ = await appointments.create_appointment_once(state.user_token, state.appoitment_id)
+    except appointments.BookingInProgress:
+        return "Seu agendamento já está sendo processado. Um instante, por favor."
+    except klingo.KlingoError as e:
+        if is_slot_conflict(e):
+            return await slot_rejected_reply(state)
+        if e.status != 401:
+            raise  # 5xx/timeout/circuito aberto/outros 4xx: mensagem de instabilidade, mantém o step
+        # token em cache venceu/revogado: descarta e identifica de novo
+        if state.user_phone and state.user_birthday_date:
+            await patients.forget_token(state.user_phone, state.user_birthday_date)
+        state.user_token = None
+        state.current_step = Step.ASK_IDENTIFY
+        return "Preciso validar seus dados novamente. Pode me confirmar seu telefone com DDD?"
+    await invalidate_slot(state.appoitment_id)  # não oferecer o horário a outro paciente
+    state.current_step = Step.ASK_PREPAY
     return (
         "Agendamento confirmado! ✅\n"
         f"- Médico: {state.doctor_name}\n"
@@ -394,9 +583,10 @@ async def step_ask_confirm_appointment(state: AgentVars, user_text: str) -> str:
     )
 
 
+@steps.step(Step.ASK_PREPAY)
 async def step_ask_prepay(state: AgentVars, user_text: str) -> str:
     if is_no(user_text):
-        state.current_step = "END"
+        state.current_step = Step.END
         return "Perfeito! Seu horário está confirmado. Até breve e boa recuperação!"
     if not is_yes(user_text):
         return "Por favor, responda com 'sim' ou 'não'."
@@ -409,7 +599,7 @@ async def step_ask_prepay(state: AgentVars, user_text: str) -> str:
         description="Consulta particular OtorrinoMed",
     )
     state.user_payment_link = pay.get("invoiceUrl")
-    state.current_step = "END"
+    state.current_step = Step.END
     return (
         "Aqui está seu link de pagamento antecipado:\n"
         f"- {state.user_payment_link}\n\n"
@@ -417,35 +607,70 @@ async def step_ask_prepay(state: AgentVars, user_text: str) -> str:
     )
 
 
+@steps.step(Step.END)
+async def step_end(state: AgentVars, user_text: str) -> str:
+    # END ou estado desconhecido: reinicia educadamente
+    state.current_step = Step.ASK_DOCTOR_PREFERENCE
+    return GREETING
+
+
+# -----------------------------------------------------------------------------
+# Hooks da FSM
+# -----------------------------------------------------------------------------
+@steps.after(Step.START)
+@steps.after(Step.END)
+async def prefetch_agenda(state: AgentVars, step: Step, user_text: str, reply: str) -> None:
+    # a saudação pergunta a preferência de médico: a agenda carrega enquanto o paciente digita
+    warm_in_background((state.especialidade, state.exame, state.plano))
+
+
+EARLY_STEPS = {Step.ASK_DOCTOR_PREFERENCE, Step.ASK_DOCTOR, Step.ASK_DATE, Step.ASK_TIME}
+
+
+@steps.before()
+async def capture_identity_early(state: AgentVars, step: Step, user_text: str) -> None:
+    # paciente que já manda telefone/nascimento antes da hora: guarda para identificar cedo
+    if step not in EARLY_STEPS:
+        return
+    if not state.user_phone:
+        state.user_phone = extract_phone(user_text)
+    if not state.user_birthday_date:
+        state.user_birthday_date = extract_birthday(user_text)
+
+
+@steps.after()
+async def identify_speculatively(state: AgentVars, step: Step, user_text: str, reply: str) -> None:
+    # identificação na Klingo corre enquanto o paciente escolhe data/horário (ou logo
+    # após um 401 na confirmação). Depois disso quem chama é o ASK_IDENTIFY: uma falha
+    # ali (paciente sem cadastro) não pode disparar outra chamada a cada turno
+    reidentify = step == Step.ASK_CONFIRM_APPOINTMENT and state.current_step == Step.ASK_IDENTIFY
+    if step not in EARLY_STEPS and not reidentify:
+        return
+    if state.user_phone and state.user_birthday_date and not state.user_token:
+        patients.start_identify(state.user_phone, state.user_birthday_date)
+
+
 # -----------------------------------------------------------------------------
 # Controlador principal (FSM)
 # -----------------------------------------------------------------------------
+STEP_LATENCY = {
+    step: histogram("otinho_step_seconds", "Latência por step da FSM", step=step.value)
+    for step in Step
+}
+
+
 async def agent_controller(state: AgentVars, user_text: str) -> str:
     # Proteção simples contra injection
     if looks_like_injection(user_text):
         user_text = ""
 
-    step = state.current_step
-
-    if step == "START":
-        return await step_start(state)
-    if step == "ASK_DOCTOR_PREFERENCE":
-        return await step_ask_doctor_preference(state, user_text)
-    if step == "ASK_DOCTOR":
-        return await step_ask_doctor(state, user_text)
-    if step == "ASK_DATE":
-        return await step_ask_date(state, user_text)
-    if step == "ASK_TIME":
-        return await step_ask_time(state, user_text)
-    if step == "ASK_IDENTIFY":
-        return await step_ask_identify(state, user_text)
-    if step == "ASK_REGISTER":
-        return await step_ask_register(state, user_text)
-    if step == "ASK_CONFIRM_APPOINTMENT":
-        return await step_ask_confirm_appointment(state, user_text)
-    if step == "ASK_PREPAY":
-        return await step_ask_prepay(state, user_text)
-
-    # END ou estado desconhecido: reinicia educadamente
-    state.current_step = "ASK_DOCTOR_PREFERENCE"
-    return GREETING
+    step = steps.resolve(state.current_step)
+    t0 = time.perf_counter()
+    try:
+        with turn_budget(settings.turn_budget_seconds):
+            return await steps.dispatch(state, user_text)
+    except (klingo.KlingoError, AsaasError):
+        # parceiro indisponível: mantém o step para o paciente tentar de novo
+        return "Nosso sistema de agendamento está instável no momento. Pode tentar novamente em instantes?"
+    finally:
+        STEP_LATENCY[step].observe(time.perf_counter() - t0)
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.agent.state import AgentVars, Step
+
+__all__ = ["StepTable", "StepHandler", "BeforeHook", "AfterHook"]
+
+StepHandler = Callable[[AgentVars, str], Awaitable[str]]
+# hooks recebem o step que está sendo executado (current_step muda dentro do handler)
+BeforeHook = Callable[[AgentVars, Step, str], Awaitable[None]]
+AfterHook = Callable[[AgentVars, Step, str, str], Awaitable[None]]
+
+
+class StepTable:
+    """
+    Tabela de despacho da FSM: Step -> handler, com hooks antes/depois.
+    Hooks registrados com step=None valem para todos os steps e rodam antes
+    dos específicos. Hooks devem tratar os próprios erros.
+    """
+
+    def __init__(self, fallback: Step = Step.END) -> None:
+        self.fallback = fallback  # step usado para estados desconhecidos
+        self._handlers: Dict[Step, StepHandler] = {}
+        self._before: Dict[Optional[Step], List[BeforeHook]] = {}
+        self._after: Dict[Optional[Step], List[AfterHook]] = {}
+
+    def step(self, step: Step) -> Callable[[StepHandler], StepHandler]:
+        def register(fn: StepHandler) -> StepHandler:
+            if step in self._handlers:
+                raise ValueError(f"Step {step.value} já registrado")
+            self._handlers[step] = fn
+            return fn
+        return register
+
+    def before(self, step: Optional[Step] = None) -> Callable[[BeforeHook], BeforeHook]:
+        def register(fn: BeforeHook) -> BeforeHook:
+            self._before.setdefault(step, []).append(fn)
+            return fn
+        return register
+
+    def after(self, step: Optional[Step] = None) -> Callable[[AfterHook], AfterHook]:
+        def register(fn: AfterHook) -> AfterHook:
+            self._after.setdefault(step, []).append(fn)
+            return fn
+        return register
+
+    def resolve(self, value: str) -> Step:
+        try:
+            step = Step(value)
+        except ValueError:
+            return self.fallback
+        return step if step in self._handlers else self.fallback
+
+    async def dispatch(self, state: AgentVars, user_text: str) -> str:
+        step = self.resolve(state.current_step)
+        for hook in (*self._before.get(None, ()), *self._before.get(step, ())):
+            await hook(state, step, user_text)
+        reply = await self._handlers[step](state, user_text)
+        for hook in (*self._after.get(None, ()), *self._after.get(step, ())):
+            await hook(state, step, user_text, reply)
+        return reply
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import asyncio
+import re
+from typing import Any, Awaitable, Callable, Dict, Literal, Optional, Sequence, TypeVar
+
+from pydantic import BaseModel
+
+from app.config import settings
+from app.services.resilience import remaining
+from app.utils.metrics import Counter, counter
+from app.utils.validators import date_calendar, to_iso_date
+
+__all__ = ["tiered", "tier_stats", "llm_date", "llm_time", "llm_doctor", "llm_sex"]
+
+# Extração em camadas: extratores determinísticos (regex/índices) primeiro; o
+# LLM só é chamado quando eles não resolvem (ou a menção é ambígua) e
+# NLU_LLM_ENABLED está ligado. Contadores por campo/tier mostram quanto do
+# tráfego nunca sai do processo.
+
+T = TypeVar("T")
+TIERS = ("regex", "llm", "miss")
+
+_counters: Dict[str, Dict[str, Counter]] = {}
+_adapter: Any = None
+_adapter_failed = False
+
+
+def _tier_counters(field: str) -> Dict[str, Counter]:
+    found = _counters.get(field)
+    if found is None:
+        found = _counters[field] = {
+            tier: counter("otinho_nlu_extractions_total", "Extrações por campo e tier", field=field, tier=tier)
+            for tier in TIERS
+        }
+    return found
+
+
+async def tiered(
+    field: str,
+    text: str,
+    deterministic: Callable[[str], Optional[T]],
+    escalate: Optional[Callable[[str], Awaitable[Optional[T]]]] = None,
+) -> Optional[T]:
+    """Valor do extrator determinístico; se vazio, do LLM (quando habilitado)."""
+    counts = _tier_counters(field)
+    try:
+        value = deterministic(text)
+    except ValueError:
+        value = None
+    if value is not None:
+        counts["regex"].inc()
+        return value
+    if escalate is not None and settings.nlu_llm_enabled:
+        value = await escalate(text)
+        if value is not None:
+            counts["llm"].inc()
+            return value
+    counts["miss"].inc()
+    return None
+
+
+def tier_stats() -> Dict[str, Dict[str, Any]]:
+    """Por campo: contagem por tier e fração resolvida sem LLM."""
+    out: Dict[str, Dict[str, Any]] = {}
+    for field, counts in _counters.items():
+        values = {tier: c.value for tier, c in counts.items()}
+        total = sum(values.values())
+        out[field] = {**values, "regex_rate": round(values["regex"] / total, 4) if total else None}
+    return out
+
+
+# -----------------------------------------------------------------------------
+# Tier LLM
+# -----------------------------------------------------------------------------
+def _llm() -> Any:
+    global _adapter, _adapter_failed
+    if _adapter is None and not _adapter_failed:
+        try:
+            from app.llm.adapter import LLMAdapter
+            _adapter = LLMAdapter()
+        except Exception:
+            _adapter_failed = True  # sem engine LLM: fica só o tier determinístico
+    return _adapter
+
+
+async def _ask(system: str, text: str, schema: type[BaseModel]) -> Optional[BaseModel]:
+    adapter = _llm()
+    if adapter is None:
+        return None
+    try:
+        timeout = remaining(settings.nlu_llm_timeout_seconds)
+        return await asyncio.wait_for(adapter.ask_json(system, text, schema), timeout)
+    except Exception:
+        # LLM lento/fora do ar não derruba o turno: o step pede o dado de novo
+        return None
+
+
+class _DateGuess(BaseModel):
+    date: Optional[str] = None
+
+
+class _TimeGuess(BaseModel):
+    time: Optional[str] = None
+
+
+class _DoctorGuess(BaseModel):
+    doctor_id: Optional[str] = None
+
+
+class _SexGuess(BaseModel):
+    sex: Optional[Literal["F", "M"]] = None
+
+
+_HHMM = re.compile(r"^(\d{1,2}):(\d{2})$")
+
+
+# system prompts fixos (um Agent por prompt no pool do adapter); o que muda a
+# cada turno — opções oferecidas e a data de hoje — vai na mensagem do usuário
+DATE_SYSTEM = (
+    "Identifique a data que o paciente escolheu entre as opções informadas "
+    "(ex.: 'amanhã', 'dia 9', 'quarta'), usando a data de hoje como referência. "
+    'Responda {"date": "aaaa-mm-dd"} ou {"date": null} se não houver uma escolha clara.'
+)
+TIME_SYSTEM = (
+    "Identifique o horário que o paciente escolheu entre as opções informadas "
+    "(ex.: 'às 9', 'o primeiro', 'nove e meia'). "
+    'Responda {"time": "HH:MM"} ou {"time": null} se não houver uma escolha clara.'
+)
+DOCTOR_SYSTEM = (
+    "Identifique qual dos médicos informados (id: nome) o paciente escolheu. "
+    'Responda {"doctor_id": "<id>"} ou {"doctor_id": null} se não for possível decidir.'
+)
+SEX_SYSTEM = (
+    "O paciente respondeu qual é o seu sexo. "
+    'Responda {"sex": "F"}, {"sex": "M"} ou {"sex": null} se a resposta não for clara.'
+)
+
+
+def _message(text: str, **context: str) -> str:
+    lines = [f"{name}: {value}" for name, value in context.items()]
+    return "\n".join([*lines, f"Mensagem do paciente: {text}"])
+
+
+async def llm_date(text: str, options: Sequence[str]) -> Optional[str]:
+    message = _message(text, Hoje=date_calendar.today().isoformat(), Opções=", ".join(options))
+    guess = await _ask(DATE_SYSTEM, message, _DateGuess)
+    if guess is None or not guess.date:
+        return None
+    try:
+        date_iso = to_iso_date(guess.date)
+    except ValueError:
+        return None
+    return date_iso if not options or date_iso in options else None
+
+
+async def llm_time(text: str, options: Sequence[str]) -> Optional[str]:
+    guess = await _ask(TIME_SYSTEM, _message(text, Opções=", ".join(options)), _TimeGuess)
+    m = _HHMM.match((guess.time or "").strip()) if guess is not None else None
+    if not m:
+        return None
+    time_ = f"{int(m.group(1)):02d}:{m.group(2)}"
+    return time_ if not options or time_ in options else None
+
+
+async def llm_doctor(text: str, options: Dict[str, str]) -> Optional[str]:
+    """options: id -> nome. Devolve o id escolhido (sempre um dos informados)."""
+    listed = "; ".join(f"{did}: {name}" for did, name in options.items())
+    guess = await _ask(DOCTOR_SYSTEM, _message(text, Médicos=listed), _DoctorGuess)
+    did = guess.doctor_id if guess is not None else None
+    return did if did in options else None
+
+
+async def llm_sex(text: str) -> Optional[str]:
+    guess = await _ask(SEX_SYSTEM, _message(text), _SexGuess)
+    return guess.sex if guess is not None else None
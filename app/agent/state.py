@@ -1,11 +1,24 @@
 from __future__ import annotations
-from pydantic import BaseModel
+from enum import Enum
+from pydantic import BaseModel, PrivateAttr
 from typing import Optional, Dict, Any
 
+class Step(str, Enum):
+    # START -> ASK_DOCTOR_PREFERENCE -> ASK_DOCTOR -> ASK_DATE -> ASK_TIME -> ASK_IDENTIFY -> ASK_REGISTER -> ASK_CONFIRM_APPOINTMENT -> ASK_PREPAY -> END
+    START = "START"
+    ASK_DOCTOR_PREFERENCE = "ASK_DOCTOR_PREFERENCE"
+    ASK_DOCTOR = "ASK_DOCTOR"
+    ASK_DATE = "ASK_DATE"
+    ASK_TIME = "ASK_TIME"
+    ASK_IDENTIFY = "ASK_IDENTIFY"
+    ASK_REGISTER = "ASK_REGISTER"
+    ASK_CONFIRM_APPOINTMENT = "ASK_CONFIRM_APPOINTMENT"
+    ASK_PREPAY = "ASK_PREPAY"
+    END = "END"
+
 class AgentVars(BaseModel):
     # FSM
-    # START -> ASK_DOCTOR_PREFERENCE -> ASK_DOCTOR -> ASK_DATE -> ASK_TIME -> ASK_IDENTIFY -> ASK_REGISTER -> ASK_CONFIRM_APPOINTMENT -> ASK_PREPAY -> END
-    current_step: str = "START"
+    current_step: Step = Step.START
     last_bot_message: Optional[str] = None
 
     # usuário
@@ -20,12 +33,18 @@ class AgentVars(BaseModel):
     user_sex: Optional[str] = None  # "M" ou "F"
 
     # médico & agenda
+    especialidade: str = "225275"       # consulta usada na Klingo (chave do cache)
+    exame: str = "1376"
+    plano: str = "1"
     doctor_id: Optional[str] = None     # usado só internamente
     doctor_name: Optional[str] = None
     appoitment_id: Optional[str] = None # slot_id da Klingo (interno)
     appoitment_date: Optional[str] = None  # yyyy-mm-dd
     appoitment_hour: Optional[str] = None  # hh:mm
+    dates_offset: int = 0   # paginação das datas do médico ("mais datas")
+    times_offset: int = 0   # paginação dos horários da data ("mais tarde")
 
     # caches
     doctors_cache: Dict[str, Any] = {}     # {doctor_id: {...}}
     agenda_reduced: Dict[str, Any] = {}    # {"doctors": ...}
+    _slot_store: Any = PrivateAttr(default=None)  # SlotStore de agenda_reduced (não serializado)
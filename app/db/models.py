@@ -37,3 +37,14 @@ class UserState(Base):
     appoitment_id: Mapped[str | None] = mapped_column(String(80))
     appoitment_date: Mapped[str | None] = mapped_column(String(10))
     appoitment_hour: Mapped[str | None] = mapped_column(String(5))
+
+class BookingRequest(Base):
+    __tablename__ = "booking_requests"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    # sha256(sha256(token)|slot_id): dedup de create_appointment entre processos
+    idempotency_key: Mapped[str] = mapped_column(String(64), unique=True, index=True)
+    slot_id: Mapped[str] = mapped_column(String(80))
+    status: Mapped[str] = mapped_column(String(16))  # pending/done
+    response: Mapped[str | None] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
@@ -0,0 +1,34 @@
+from __future__ import annotations
+import asyncio
+from typing import Any
+from app.config import settings
+
+# Client Redis opcional (extra "redis"): sem redis_url ou sem o pacote, retorna None
+_redis: Any = None
+_redis_loop: asyncio.AbstractEventLoop | None = None
+
+
+async def get_redis() -> Any:
+    global _redis, _redis_loop
+    if not settings.redis_url:
+        return None
+    try:
+        import redis.asyncio as aioredis  # type: ignore
+    except Exception:
+        return None
+    loop = asyncio.get_running_loop()
+    if _redis is None or _redis_loop is not loop:
+        # conexões ficam presas ao loop em que foram criadas
+        _redis = aioredis.from_url(settings.redis_url)
+        _redis_loop = loop
+    return _redis
+
+
+async def close_redis() -> None:
+    global _redis, _redis_loop
+    client, loop = _redis, _redis_loop
+    _redis, _redis_loop = None, None
+    if client is None or loop is not asyncio.get_running_loop():
+        return
+    close = getattr(client, "aclose", None) or client.close
+    await close()
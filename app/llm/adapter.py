@@ -1,8 +1,14 @@
 from __future__ import annotations
+import hashlib
 import json
-from typing import Type, TypeVar, Any, Dict
+import time
+from typing import AsyncIterator, Type, TypeVar, Any, Dict, Optional
+from cachetools import LRUCache
 from pydantic import BaseModel, TypeAdapter
 from app.config import settings
+from app.llm.cache import llm_cache
+from app.llm.limiter import estimate_tokens, llm_limiter
+from app.utils.metrics import histogram, timed
 
 # Carrega .env se existir (garante OPENAI_API_KEY)
 try:
@@ -13,6 +19,61 @@ except Exception:
 
 T = TypeVar("T", bound=BaseModel)
 
+_first_token = histogram(
+    "otinho_llm_first_token_seconds", "Tempo até o primeiro trecho em stream_text"
+)
+
+JSON_ONLY = "\nResponda ESTRITAMENTE em JSON válido, sem texto extra."
+
+# Pool de agentes e client OpenAI compartilhados pelo processo: construir um
+# Agent por chamada custa CPU e perde o keep-alive das conexões com o provedor.
+_agents: LRUCache = LRUCache(maxsize=64)  # (modelo, sha256(prompt), schema) -> Agent
+_shared_openai: Any = None
+
+
+def _openai_client() -> Any:
+    global _shared_openai
+    if _shared_openai is None:
+        from openai import AsyncOpenAI  # type: ignore
+        _shared_openai = AsyncOpenAI()
+    return _shared_openai
+
+
+def _pai_model(model: str) -> Any:
+    """Modelo pydantic_ai sobre o client OpenAI compartilhado; senão, o nome (client próprio)."""
+    try:
+        from pydantic_ai.providers.openai import OpenAIProvider  # type: ignore
+        try:
+            from pydantic_ai.models.openai import OpenAIChatModel as OpenAIModel  # type: ignore
+        except ImportError:
+            from pydantic_ai.models.openai import OpenAIModel  # type: ignore
+        return OpenAIModel(model, provider=OpenAIProvider(openai_client=_openai_client()))
+    except Exception:
+        return model
+
+
+def _schema_name(schema: Optional[type]) -> Optional[str]:
+    return f"{schema.__module__}.{schema.__qualname__}" if schema is not None else None
+
+
+def pooled_agent(model: str, system_prompt: str, schema: Optional[type] = None) -> Any:
+    """Agent pydantic_ai reaproveitado por (modelo, hash do system prompt, schema)."""
+    key = (model, hashlib.sha256(system_prompt.encode("utf-8")).hexdigest(), _schema_name(schema))
+    agent = _agents.get(key)
+    if agent is None:
+        from pydantic_ai import Agent  # type: ignore
+        agent = _agents[key] = Agent(_pai_model(model), system_prompt=system_prompt)
+    return agent
+
+
+def _result_text(result: Any) -> str:
+    # AgentRunResult.output (versões atuais) / .data (antigas)
+    for attr in ("output", "data", "output_text"):
+        value = getattr(result, attr, None)
+        if isinstance(value, str):
+            return value
+    return str(result)
+
 def _json_to_python(payload: str | dict) -> Any:
     if isinstance(payload, str):
         try:
@@ -26,6 +87,10 @@ def _validate_with_schema(schema: Type[T], payload: str | dict) -> T:
     data = _json_to_python(payload)
     return adapter.validate_python(data)
 
+def _use_cache(cache: Optional[bool]) -> bool:
+    return settings.llm_cache_enabled if cache is None else cache
+
+
 class LLMAdapter:
     """
     Abstrai Pydantic AI; se não der certo, usa OpenAI JSON-mode.
@@ -46,27 +111,46 @@ class LLMAdapter:
 
         # prepara OpenAI client (para fallback ou uso direto)
         try:
-            from openai import AsyncOpenAI  # type: ignore
-            self._openai = AsyncOpenAI()
+            self._openai = _openai_client()
         except Exception:
             if self._mode == "openai":
                 raise RuntimeError(
                     "Nenhuma engine LLM disponível. Instale 'pydantic-ai' ou 'openai' e defina OPENAI_API_KEY."
                 )
 
-    async def ask_dict(self, system: str, user: str) -> Dict[str, Any]:
+    async def ask_dict(self, system: str, user: str, cache: Optional[bool] = None) -> Dict[str, Any]:
         """
         Pede JSON e retorna um dict Python (sem validar schema).
+        cache=None segue LLM_CACHE_ENABLED; True/False força por chamada.
         """
+        if not _use_cache(cache):
+            return await self._limited_dict(system, user)
+        key = llm_cache.key(self.model, system, user)
+        hit = await llm_cache.get(key)
+        if hit is not None:
+            return hit
+        data = await self._limited_dict(system, user)
+        if data:
+            await llm_cache.set(key, data)
+        return data
+
+    # fila do limitador fora do histograma de latência (tem métrica própria)
+    async def _limited_dict(self, system: str, user: str) -> Dict[str, Any]:
+        async with llm_limiter.slot(estimate_tokens(system, user)):
+            return await self._ask_dict(system, user)
+
+    async def _limited_json(self, system: str, user: str, schema: Type[T]) -> T:
+        async with llm_limiter.slot(estimate_tokens(system, user)):
+            return await self._ask_json(system, user, schema)
+
+    @timed(histogram("otinho_llm_call_seconds", "Latência das chamadas ao LLM", method="ask_dict"))
+    async def _ask_dict(self, system: str, user: str) -> Dict[str, Any]:
         # 1) tenta pydantic_ai
         if self._mode == "pydantic_ai" and self._pai is not None:
             try:
-                from pydantic_ai import Agent  # type: ignore
-                sys_prompt = system + "\nResponda ESTRITAMENTE em JSON válido, sem texto extra."
-                agent = Agent(self.model, system_prompt=sys_prompt)
+                agent = pooled_agent(self.model, system + JSON_ONLY)
                 result = await agent.run(user)
-                text = getattr(result, "output_text", None) or str(result)
-                return _json_to_python(text) or {}
+                return _json_to_python(_result_text(result)) or {}
             except Exception:
                 pass
 
@@ -84,19 +168,32 @@ class LLMAdapter:
         content = r.choices[0].message.content or "{}"
         return _json_to_python(content) or {}
 
-    async def ask_json(self, system: str, user: str, schema: Type[T]) -> T:
+    async def ask_json(self, system: str, user: str, schema: Type[T], cache: Optional[bool] = None) -> T:
         """
         Mantido para compatibilidade: pede JSON e valida com schema Pydantic.
+        cache=None segue LLM_CACHE_ENABLED; True/False força por chamada.
         """
+        if not _use_cache(cache):
+            return await self._limited_json(system, user, schema)
+        key = llm_cache.key(self.model, system, user, schema)
+        hit = await llm_cache.get(key)
+        if hit is not None:
+            try:
+                return _validate_with_schema(schema, hit)
+            except Exception:
+                pass
+        result = await self._limited_json(system, user, schema)
+        await llm_cache.set(key, result.model_dump(mode="json"))
+        return result
+
+    @timed(histogram("otinho_llm_call_seconds", "Latência das chamadas ao LLM", method="ask_json"))
+    async def _ask_json(self, system: str, user: str, schema: Type[T]) -> T:
         # Tenta pydantic_ai
         if self._mode == "pydantic_ai" and self._pai is not None:
             try:
-                from pydantic_ai import Agent  # type: ignore
-                sys_prompt = system + "\nResponda ESTRITAMENTE em JSON válido, sem texto extra."
-                agent = Agent(self.model, system_prompt=sys_prompt)
+                agent = pooled_agent(self.model, system + JSON_ONLY, schema)
                 result = await agent.run(user)
-                text = getattr(result, "output_text", None) or str(result)
-                return _validate_with_schema(schema, text)
+                return _validate_with_schema(schema, _result_text(result))
             except Exception:
                 pass
 
@@ -113,3 +210,47 @@ class LLMAdapter:
         )
         content = r.choices[0].message.content or "{}"
         return _validate_with_schema(schema, content)
+
+    async def stream_text(self, system: str, user: str) -> AsyncIterator[str]:
+        """
+        Resposta em texto livre como trechos (deltas), à medida que o modelo gera.
+        Se o pydantic_ai falhar antes do primeiro trecho, cai para o stream do OpenAI.
+        Consuma o iterador numa única task: o run_stream do pydantic_ai não atravessa tasks.
+        """
+        async with llm_limiter.slot(estimate_tokens(system, user)):
+            t0 = time.perf_counter()
+            started = False
+            if self._mode == "pydantic_ai" and self._pai is not None:
+                try:
+                    agent = pooled_agent(self.model, system)
+                    async with agent.run_stream(user) as result:
+                        async for delta in result.stream_text(delta=True):
+                            if not delta:
+                                continue
+                            if not started:
+                                started = True
+                                _first_token.observe(time.perf_counter() - t0)
+                            yield delta
+                    return
+                except Exception:
+                    if started:
+                        raise  # já entregamos parte do texto: não dá para recomeçar
+
+            if self._openai is None:
+                raise RuntimeError("OpenAI client não inicializado e pydantic_ai falhou.")
+            stream = await self._openai.chat.completions.create(
+                model=self.model,
+                stream=True,
+                messages=[
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": user},
+                ],
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if not started:
+                    started = True
+                    _first_token.observe(time.perf_counter() - t0)
+                yield delta
@@ -0,0 +1,99 @@
+from __future__ import annotations
+import hashlib
+import json
+import re
+import unicodedata
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+
+from app.config import settings
+from app.db.redis import get_redis
+
+# Cache de respostas do LLM (opt-in, LLM_CACHE_ENABLED): extrações são funções
+# puras de (modelo, system prompt, texto, schema) e as mesmas frases se repetem
+# entre pacientes ("amanhã de manhã", "sem preferência"). LRU+TTL local e,
+# com redis_url, tier compartilhado entre workers. Os valores são JSON.
+
+LLM_CACHE_VERSION = 1  # incremente ao mudar prompts/formato de forma incompatível
+_REDIS_PREFIX = f"otinho:llm:v{LLM_CACHE_VERSION}"
+_SPACES = re.compile(r"\s+")
+_EDGE_PUNCT = " \t\n.!?,;…"
+
+
+def normalize_input(text: str) -> str:
+    """Variações triviais caem na mesma chave: "  Amanhã de manhã! " -> "amanhã de manhã"."""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return _SPACES.sub(" ", text).strip(_EDGE_PUNCT)
+
+
+def schema_version(schema: Optional[type]) -> str:
+    """Impressão digital do JSON schema: mudar campos/tipos invalida as entradas antigas."""
+    if schema is None:
+        return "dict"
+    try:
+        raw = json.dumps(schema.model_json_schema(), sort_keys=True)  # type: ignore[attr-defined]
+    except Exception:
+        raw = f"{schema.__module__}.{schema.__qualname__}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class LLMCache:
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.ttl = ttl
+        self._local: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def key(self, model: str, system: str, user: str, schema: Optional[type] = None) -> str:
+        parts = [model, system, normalize_input(user), schema_version(schema)]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = self._local.get(key)
+        if raw is None:
+            raw = await self._redis_get(key)
+            if raw is None:
+                self.misses += 1
+                return None
+            self._local[key] = raw
+            self.redis_hits += 1
+        else:
+            self.hits += 1
+        return json.loads(raw)  # sempre uma cópia nova: o chamador pode alterar
+
+    async def set(self, key: str, value: Any) -> None:
+        raw = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        self._local[key] = raw
+        r = await get_redis()
+        if r is None:
+            return
+        try:
+            await r.set(f"{_REDIS_PREFIX}:{key}", raw, ex=max(1, int(self.ttl)))
+        except Exception:
+            pass
+
+    async def _redis_get(self, key: str) -> Optional[str]:
+        r = await get_redis()
+        if r is None:
+            return None
+        try:
+            raw = await r.get(f"{_REDIS_PREFIX}:{key}")
+        except Exception:
+            return None
+        return raw.decode("utf-8") if isinstance(raw, bytes) else raw
+
+    def clear(self) -> None:
+        self._local.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "size": len(self._local),
+        }
+
+
+llm_cache = LLMCache(settings.llm_cache_maxsize, settings.llm_cache_ttl_seconds)
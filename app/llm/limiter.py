@@ -0,0 +1,130 @@
+from __future__ import annotations
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from app.config import settings
+from app.services.resilience import remaining
+from app.utils.metrics import counter, histogram
+
+# Controle de vazão das chamadas ao LLM (por processo): semáforo de concorrência
+# + baldes de requisições/min e tokens/min do provedor. Quem chega acima do
+# limite espera na fila (ordem de chegada) até LLM_MAX_WAIT_SECONDS (ou o que
+# resta do turno); depois disso desiste com LLMRateLimited, sem tomar 429.
+
+CHARS_PER_TOKEN = 4  # estimativa grosseira para texto em português
+
+
+class LLMRateLimited(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    """Capacidade = limite por minuto; reabastece continuamente (limite/60 por segundo)."""
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, n: float) -> float:
+        """Segundos até haver `n` tokens (0 = já há)."""
+        self._refill()
+        n = min(n, self.capacity)  # pedido maior que o balde não pode esperar para sempre
+        return 0.0 if self.tokens >= n else (n - self.tokens) / self.rate
+
+    def take(self, n: float) -> None:
+        self.tokens -= min(n, self.capacity)
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Tokens de entrada estimados + orçamento de saída (LLM_OUTPUT_TOKENS_ESTIMATE)."""
+    chars = sum(len(t or "") for t in texts)
+    return chars // CHARS_PER_TOKEN + settings.llm_output_tokens_estimate
+
+
+class LLMLimiter:
+    def __init__(
+        self,
+        max_concurrency: int,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        max_wait_seconds: float,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_wait_seconds = max_wait_seconds
+        self._rpm = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._tpm = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        # criados no primeiro uso: ficam presos ao loop do processo
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._order: Optional[asyncio.Lock] = None
+        self.waiting = 0
+        self._queue_time = histogram(
+            "otinho_llm_queue_seconds", "Espera na fila do limitador antes da chamada ao LLM",
+            buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+        )
+        self._rejected = counter("otinho_llm_rate_limited_total", "Chamadas ao LLM desistidas na fila")
+
+    def _bucket_delay(self, tokens: int) -> float:
+        return max(
+            self._rpm.delay_for(1) if self._rpm else 0.0,
+            self._tpm.delay_for(tokens) if self._tpm else 0.0,
+        )
+
+    async def _wait_buckets(self, tokens: int, deadline: float) -> None:
+        if self._order is None:
+            self._order = asyncio.Lock()
+        async with self._order:  # FIFO: quem chegou antes consome antes
+            while True:
+                delay = self._bucket_delay(tokens)
+                if delay == 0.0:
+                    break
+                if time.monotonic() + delay > deadline:
+                    raise LLMRateLimited("limite de requisições/tokens do LLM: fila excedeu a espera máxima")
+                await asyncio.sleep(delay)
+            if self._rpm:
+                self._rpm.take(1)
+            if self._tpm:
+                self._tpm.take(tokens)
+
+    @asynccontextmanager
+    async def slot(self, tokens: int) -> AsyncIterator[None]:
+        """Reserva vazão para uma chamada de ~`tokens` tokens; espera na fila se preciso."""
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        t0 = time.monotonic()
+        deadline = t0 + remaining(self.max_wait_seconds)  # não espera além do turno
+        self.waiting += 1
+        try:
+            await self._wait_buckets(tokens, deadline)
+            if self._sem.locked():
+                await asyncio.wait_for(self._sem.acquire(), max(0.0, deadline - time.monotonic()))
+            else:
+                await self._sem.acquire()
+        except (LLMRateLimited, asyncio.TimeoutError, TimeoutError) as exc:
+            self._rejected.inc()
+            if isinstance(exc, LLMRateLimited):
+                raise
+            raise LLMRateLimited("concorrência máxima do LLM: fila excedeu a espera máxima") from exc
+        finally:
+            self.waiting -= 1
+            self._queue_time.observe(time.monotonic() - t0)
+        try:
+            yield
+        finally:
+            self._sem.release()
+
+
+llm_limiter = LLMLimiter(
+    settings.llm_max_concurrency,
+    settings.llm_requests_per_minute,
+    settings.llm_tokens_per_minute,
+    settings.llm_max_wait_seconds,
+)
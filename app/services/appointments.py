@@ -0,0 +1,157 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Dict, Optional, Tuple, TypeVar
+
+from cachetools import TTLCache
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.config import settings
+from app.db.models import BookingRequest
+from app.db.session import AsyncSessionLocal
+from app.services import klingo
+from app.services.resilience import NOT_SENT, BudgetExceeded, CircuitOpenError, remaining
+from app.utils.singleflight import SingleFlight
+
+# Agendamento idempotente: a mesma (token, slot) nunca gera duas chamadas a
+# create_appointment. Duplicatas no processo aguardam a chamada em andamento
+# (single-flight); entre processos/reinícios, a tabela booking_requests guarda
+# a reserva "pending" e o resultado "done".
+
+
+T = TypeVar("T")
+
+
+class BookingInProgress(RuntimeError):
+    pass
+
+
+_flight = SingleFlight()
+_done: TTLCache = TTLCache(maxsize=4096, ttl=settings.booking_dedup_ttl_seconds)
+# falhas ambíguas (a Klingo pode ter agendado): bloqueia nova chamada até o timeout do pending
+_uncertain: TTLCache = TTLCache(maxsize=4096, ttl=settings.booking_pending_timeout_seconds)
+
+
+def booking_key(token: str, slot_id: str) -> str:
+    token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{token_hash}|{slot_id}".encode("utf-8")).hexdigest()
+
+
+def definitely_not_booked(exc: BaseException) -> bool:
+    """Requisição não saiu (circuito aberto, conexão/pool, prazo esgotado antes) ou 4xx definitivo."""
+    if not isinstance(exc, klingo.KlingoError):
+        return False
+    cause = exc.__cause__
+    if cause is None:
+        return 400 <= exc.status < 500
+    return isinstance(cause, (CircuitOpenError, BudgetExceeded, *NOT_SENT))
+
+
+async def _db(op: Awaitable[T]) -> T:
+    """Operação no banco com prazo curto (dentro do turno): banco fora cai para a memória."""
+    return await asyncio.wait_for(op, remaining(settings.booking_db_timeout_seconds))
+
+
+async def _claim(key: str, slot_id: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """(reservou?, resultado anterior). Sem reserva e sem resultado = outro processo em andamento."""
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as session:
+        row = await session.scalar(
+            select(BookingRequest).where(BookingRequest.idempotency_key == key)
+        )
+        if row is not None:
+            if row.status == "done":
+                return False, json.loads(row.response or "{}")
+            if now - row.updated_at < timedelta(seconds=settings.booking_pending_timeout_seconds):
+                return False, None
+            # tentativa anterior morreu sem concluir: assume a reserva, se ninguém assumiu antes
+            taken = await session.execute(
+                update(BookingRequest)
+                .where(
+                    BookingRequest.idempotency_key == key,
+                    BookingRequest.status == "pending",
+                    BookingRequest.updated_at == row.updated_at,
+                )
+                .values(updated_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            return taken.rowcount == 1, None
+        session.add(BookingRequest(
+            idempotency_key=key, slot_id=slot_id, status="pending", created_at=now, updated_at=now
+        ))
+        try:
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            return False, None
+        return True, None
+
+
+async def _complete(key: str, result: Dict[str, Any]) -> None:
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(BookingRequest)
+            .where(BookingRequest.idempotency_key == key)
+            .values(status="done", response=json.dumps(result), updated_at=datetime.utcnow())
+        )
+        await session.commit()
+
+
+async def _release(key: str) -> None:
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            delete(BookingRequest).where(
+                BookingRequest.idempotency_key == key, BookingRequest.status == "pending"
+            )
+        )
+        await session.commit()
+
+
+async def _book(key: str, token: str, slot_id: str) -> Dict[str, Any]:
+    persisted = True
+    try:
+        claimed, previous = await _db(_claim(key, slot_id))
+    except Exception:
+        # banco indisponível: segue só com a deduplicação em memória
+        persisted, claimed, previous = False, True, None
+    if previous is not None:
+        _done[key] = previous
+        return previous
+    if not claimed:
+        raise BookingInProgress("agendamento já em processamento")
+
+    try:
+        result = await klingo.create_appointment(token, slot_id)
+    except Exception as exc:
+        if not definitely_not_booked(exc):
+            # timeout/5xx após o envio: pode ter agendado. Mantém "pending" até o timeout
+            _uncertain[key] = True
+            raise
+        if persisted:
+            try:
+                await _db(_release(key))  # com certeza não agendou: libera para nova tentativa
+            except Exception:
+                pass
+        raise
+
+    _done[key] = result
+    if persisted:
+        try:
+            await _db(_complete(key, result))
+        except Exception:
+            pass
+    return result
+
+
+async def create_appointment_once(token: str, slot_id: str) -> Dict[str, Any]:
+    """create_appointment com deduplicação por (hash do token, slot_id)."""
+    key = booking_key(token, slot_id)
+    if key in _done:
+        return _done[key]
+    if key in _uncertain:
+        raise BookingInProgress("resultado do agendamento anterior ainda incerto")
+    return await _flight.do(key, lambda: _book(key, token, slot_id))
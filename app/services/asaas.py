@@ -2,10 +2,26 @@ from __future__ import annotations
 import httpx
 from typing import Dict, Any
 from app.config import settings
+from app.services.resilience import (
+    BudgetExceeded,
+    CircuitBreaker,
+    CircuitOpenError,
+    resilient_call,
+)
+from app.utils.metrics import histogram, timed
 
 class AsaasError(RuntimeError):
-    pass
+    def __init__(self, status: int, detail: str):
+        super().__init__(f"{status}: {detail}")
+        self.status = status
+        self.detail = detail
 
+breaker = CircuitBreaker("asaas", settings.breaker_failure_threshold, settings.breaker_reset_seconds)
+
+def _is_failure(exc: BaseException) -> bool:
+    return isinstance(exc, AsaasError) and (exc.status >= 500 or exc.status == 429)
+
+@timed(histogram("otinho_asaas_request_seconds", "Latência das chamadas ao Asaas", endpoint="create_payment_link"))
 async def create_payment_link(
     customer_name: str,
     customer_email: str,
@@ -29,16 +45,27 @@ async def create_payment_link(
         "description": "Consulta Médica escription",
         "dueDateLimitDays": 10,
     }
-    async with httpx.AsyncClient(
-        base_url=settings.asaas_base_url,
-        timeout=settings.request_timeout_seconds,
-        headers=headers,
-    ) as client:
-        r = await client.post("/payments", json=payload)
-        if r.status_code not in (200, 201):
-            raise AsaasError(f"{r.status_code}: {r.text}")
-        data = r.json()
-        return {
-            "paymentId": data.get("id"),
-            "invoiceUrl": data.get("invoiceUrl") or data.get("bankSlipUrl") or data.get("invoiceUrl"),
-        }
+    async def attempt(timeout: float) -> Dict[str, Any]:
+        async with httpx.AsyncClient(
+            base_url=settings.asaas_base_url,
+            timeout=timeout,
+            headers=headers,
+        ) as client:
+            r = await client.post("/payments", json=payload)
+            if r.status_code not in (200, 201):
+                raise AsaasError(r.status_code, r.text)
+            return r.json()
+
+    # criar cobrança não é idempotente: só repete se a requisição nem saiu
+    try:
+        data = await resilient_call(attempt, breaker=breaker, idempotent=False, is_failure=_is_failure)
+    except CircuitOpenError as e:
+        raise AsaasError(503, str(e)) from e
+    except (BudgetExceeded, httpx.TimeoutException) as e:
+        raise AsaasError(504, f"timeout: {e}") from e
+    except httpx.TransportError as e:
+        raise AsaasError(502, f"falha de rede: {e}") from e
+    return {
+        "paymentId": data.get("id"),
+        "invoiceUrl": data.get("invoiceUrl") or data.get("bankSlipUrl") or data.get("invoiceUrl"),
+    }
@@ -1,7 +1,15 @@
 from __future__ import annotations
+import asyncio
 import httpx
 from typing import Any, Dict
 from app.config import settings
+from app.services.resilience import (
+    BudgetExceeded,
+    CircuitBreaker,
+    CircuitOpenError,
+    resilient_call,
+)
+from app.utils.metrics import histogram, timed
 
 HEADERS = {
     "accept": "application/json",
@@ -14,29 +22,130 @@ class KlingoError(RuntimeError):
         self.status = status
         self.detail = detail
 
-async def _client() -> httpx.AsyncClient:
+# -----------------------------------------------------------------------------
+# Client compartilhado (pool + keep-alive): evita handshake TCP/TLS a cada turno
+# -----------------------------------------------------------------------------
+_shared_client: httpx.AsyncClient | None = None
+_shared_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _http2_enabled() -> bool:
+    if not settings.klingo_http2:
+        return False
+    try:
+        import h2  # type: ignore  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+def _build_client() -> httpx.AsyncClient:
     return httpx.AsyncClient(
         base_url=settings.klingo_base_url,
         timeout=settings.request_timeout_seconds,
         headers=HEADERS,
+        limits=httpx.Limits(
+            max_connections=settings.klingo_max_connections,
+            max_keepalive_connections=settings.klingo_max_keepalive_connections,
+            keepalive_expiry=settings.klingo_keepalive_expiry_seconds,
+        ),
+        http2=_http2_enabled(),
     )
 
-async def get_agenda(especialidade: str = "225275", exame: str = "1376", plano: str = "1") -> Dict[str, Any]:
-    url = f"/agenda/horarios?especialidade={especialidade}&exame={exame}&plano={plano}"
-    async with await _client() as client:
-        r = await client.get(url)
+
+async def startup() -> httpx.AsyncClient:
+    """Cria (ou reaproveita) o client do processo, preso ao event loop atual."""
+    global _shared_client, _shared_loop
+    loop = asyncio.get_running_loop()
+    if _shared_client is None or _shared_client.is_closed or _shared_loop is not loop:
+        # um client de outro loop não pode ser reutilizado (nem fechado) aqui
+        _shared_client = _build_client()
+        _shared_loop = loop
+    return _shared_client
+
+
+async def shutdown() -> None:
+    """Fecha o pool de conexões. Chamar no encerramento do processo."""
+    global _shared_client, _shared_loop
+    client, loop = _shared_client, _shared_loop
+    _shared_client, _shared_loop = None, None
+    if client is not None and not client.is_closed and loop is asyncio.get_running_loop():
+        await client.aclose()
+
+
+async def _client() -> httpx.AsyncClient:
+    return await startup()
+
+
+def _register_headers() -> Dict[str, str]:
+    # alguns ambientes usam outro token para register/login; se houver, usa-o
+    return {
+        "X-APP-TOKEN": getattr(settings, "klingo_register_token", None) or settings.klingo_app_token,
+        "Content-Type": "application/json",
+    }
+
+
+def _bearer_headers(token: str) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {token}"}
+
+
+breaker = CircuitBreaker(
+    "klingo", settings.breaker_failure_threshold, settings.breaker_reset_seconds
+)
+
+
+def _is_failure(exc: BaseException) -> bool:
+    # 5xx/429 indicam parceiro degradado; demais status são respostas de negócio
+    return isinstance(exc, KlingoError) and (exc.status >= 500 or exc.status == 429)
+
+
+async def _request(
+    method: str,
+    url: str,
+    *,
+    json: Any = None,
+    headers: Dict[str, str] | None = None,
+    idempotent: bool = False,
+) -> Dict[str, Any]:
+    """
+    Executa a chamada no client compartilhado; headers são sobrescritos só nesta chamada.
+    Só chamadas idempotentes são repetidas após resposta 5xx/timeout; as demais só
+    quando a requisição nem saiu (erro de conexão). Falhas de rede viram KlingoError.
+    """
+    async def attempt(timeout: float) -> Dict[str, Any]:
+        client = await _client()
+        r = await client.request(method, url, json=json, headers=headers, timeout=timeout)
         if r.status_code != 200:
             raise KlingoError(r.status_code, r.text)
         return r.json()
 
+    try:
+        return await resilient_call(
+            attempt, breaker=breaker, idempotent=idempotent, is_failure=_is_failure
+        )
+    except CircuitOpenError as e:
+        raise KlingoError(503, str(e)) from e
+    except (BudgetExceeded, httpx.TimeoutException) as e:
+        raise KlingoError(504, f"timeout: {e}") from e
+    except httpx.TransportError as e:
+        raise KlingoError(502, f"falha de rede: {e}") from e
+
+
+def _latency(endpoint: str):
+    return timed(histogram("otinho_klingo_request_seconds", "Latência das chamadas à Klingo", endpoint=endpoint))
+
+@_latency("get_agenda")
+async def get_agenda(especialidade: str = "225275", exame: str = "1376", plano: str = "1") -> Dict[str, Any]:
+    url = f"/agenda/horarios?especialidade={especialidade}&exame={exame}&plano={plano}"
+    return await _request("GET", url, idempotent=True)
+
+@_latency("identify_user")
 async def identify_user(phone: str, birthday_iso: str, cpf: str | None = "") -> Dict[str, Any]:
     payload = {"telefone": phone, "dt_nascimento": birthday_iso, "cpf": cpf or ""}
-    async with await _client() as client:
-        r = await client.post("/paciente/identificar", json=payload)
-        if r.status_code != 200:
-            raise KlingoError(r.status_code, r.text)
-        return r.json()
+    # consulta sem efeito colateral: pode repetir
+    return await _request("POST", "/paciente/identificar", json=payload, idempotent=True)
 
+@_latency("register_user")
 async def register_user(
     fullname: str,
     email: str,
@@ -75,40 +184,18 @@ async def register_user(
             },
         }
     }
-    # alguns ambientes usam outro token para register/login; se houver, usa-o
-    headers = {
-        "accept": "application/json",
-        "X-APP-TOKEN": getattr(settings, "klingo_register_token", None) or settings.klingo_app_token,
-        "Content-Type": "application/json",
-    }
-    async with httpx.AsyncClient(
-        base_url=settings.klingo_base_url,
-        timeout=settings.request_timeout_seconds,
-        headers=headers,
-    ) as client:
-        r = await client.post("/externo/register", json=payload)
-        if r.status_code != 200:
-            raise KlingoError(r.status_code, r.text)
-        return r.json()
+    return await _request("POST", "/externo/register", json=payload, headers=_register_headers())
 
 
+@_latency("login_user")
 async def login_user(user_id: int) -> Dict[str, Any]:
-    headers = {
-        "accept": "application/json",
-        "X-APP-TOKEN": getattr(settings, "klingo_register_token", None) or settings.klingo_app_token,
-        "Content-Type": "application/json",
-    }
-    async with await _client() as client:
-        # sobrescreve headers na chamada
-        r = await client.post("/externo/login", json={"id": user_id}, headers=headers)
-        if r.status_code != 200:
-            raise KlingoError(r.status_code, r.text)
-        return r.json()
+    return await _request(
+        "POST", "/externo/login", json={"id": user_id}, headers=_register_headers(), idempotent=True
+    )
 
 
+@_latency("create_appointment")
 async def create_appointment(token: str, slot_id: str) -> Dict[str, Any]:
-    headers = dict(HEADERS)
-    headers["Authorization"] = f"Bearer {token}"
     payload = {
         "procedimento": "1000",
         "id": slot_id,  # formato completo vindo de horarios.keys()
@@ -131,12 +218,4 @@ async def create_appointment(token: str, slot_id: str) -> Dict[str, Any]:
         "duracao": 10,
         "id_ampliar": 0,
     }
-    async with httpx.AsyncClient(
-        base_url=settings.klingo_base_url,
-        timeout=settings.request_timeout_seconds,
-        headers=headers,
-    ) as client:
-        r = await client.post("/agenda/horario", json=payload)
-        if r.status_code != 200:
-            raise KlingoError(r.status_code, r.text)
-        return r.json()
+    return await _request("POST", "/agenda/horario", json=payload, headers=_bearer_headers(token))
@@ -0,0 +1,162 @@
+from __future__ import annotations
+import asyncio
+import base64
+import hashlib
+import json
+import time
+from typing import Any, Dict, Optional
+
+from cachetools import TLRUCache, TTLCache
+
+from app.config import settings
+from app.db.redis import get_redis
+from app.services import klingo
+from app.services.resilience import detach_budget, join_timeout
+
+# Identificação especulativa: assim que telefone e nascimento são conhecidos,
+# a chamada à Klingo é disparada em background e o resultado fica guardado
+# (por hash da identidade) até o step ASK_IDENTIFY consumi-lo.
+#
+# Cache de access_token: paciente que volta em outra sessão reaproveita o token
+# enquanto ele não vence. LRU local com TTL do próprio token (claim "exp") e,
+# se configurado, tier Redis com o token cifrado (Fernet, TOKEN_CACHE_KEY).
+
+TOKEN_EXPIRY_SKEW_SECONDS = 60  # folga para não usar token prestes a vencer
+_TOKEN_PREFIX = "otinho:token:v1"
+
+_identify_tasks: TTLCache = TTLCache(maxsize=1024, ttl=settings.identify_cache_ttl_seconds)
+# identity_key -> (token, ttl em segundos)
+_tokens: TLRUCache = TLRUCache(
+    maxsize=settings.token_cache_maxsize, ttu=lambda _key, value, now: now + value[1]
+)
+_fernet: Any = None
+
+
+def identity_key(phone: str, birthday_iso: str) -> str:
+    """Hash da identidade do paciente (nunca guardamos telefone/nascimento em claro)."""
+    return hashlib.sha256(f"{phone}|{birthday_iso}".encode("utf-8")).hexdigest()
+
+
+def token_ttl(token: str) -> float:
+    """Segundos até o vencimento do JWT (claim exp), com folga; sem exp usa o padrão."""
+    try:
+        part = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(part + "=" * (-len(part) % 4)))
+        return max(0.0, float(claims["exp"]) - time.time() - TOKEN_EXPIRY_SKEW_SECONDS)
+    except Exception:
+        return float(settings.token_cache_default_ttl_seconds)
+
+
+def _cipher() -> Any:
+    global _fernet
+    if _fernet is None and settings.token_cache_key:
+        try:
+            from cryptography.fernet import Fernet  # type: ignore
+            _fernet = Fernet(settings.token_cache_key.encode("utf-8"))
+        except Exception:
+            return None
+    return _fernet
+
+
+async def _token_redis() -> Any:
+    # só usa o Redis se for possível cifrar o token
+    if _cipher() is None:
+        return None
+    return await get_redis()
+
+
+async def cached_token(key: str) -> Optional[str]:
+    hit = _tokens.get(key)
+    if hit:
+        return hit[0]
+    r = await _token_redis()
+    if r is None:
+        return None
+    try:
+        blob = await r.get(f"{_TOKEN_PREFIX}:{key}")
+        if blob is None:
+            return None
+        token = _cipher().decrypt(blob).decode("utf-8")
+    except Exception:
+        return None
+    ttl = token_ttl(token)
+    if ttl > 0:
+        _tokens[key] = (token, ttl)
+        return token
+    return None
+
+
+async def _store_token(key: str, token: str) -> None:
+    ttl = token_ttl(token)
+    if ttl <= 0:
+        return
+    _tokens[key] = (token, ttl)
+    r = await _token_redis()
+    if r is None:
+        return
+    try:
+        await r.set(f"{_TOKEN_PREFIX}:{key}", _cipher().encrypt(token.encode("utf-8")), ex=max(1, int(ttl)))
+    except Exception:
+        pass
+
+
+async def remember_token(phone: str, birthday_iso: str, token: str) -> None:
+    """Guarda o token obtido fora da identificação (ex.: login após cadastro)."""
+    await _store_token(identity_key(phone, birthday_iso), token)
+
+
+async def forget_token(phone: str, birthday_iso: str) -> None:
+    """Descarta o token (ex.: Klingo respondeu 401)."""
+    key = identity_key(phone, birthday_iso)
+    _tokens.pop(key, None)
+    _identify_tasks.pop(key, None)
+    r = await _token_redis()
+    if r is not None:
+        try:
+            await r.delete(f"{_TOKEN_PREFIX}:{key}")
+        except Exception:
+            pass
+
+
+async def _identify(key: str, phone: str, birthday_iso: str) -> Dict[str, Any]:
+    detach_budget()  # especulativa: não herda o prazo do turno que a disparou
+    token = await cached_token(key)
+    if token:
+        return {"access_token": token}
+    ident = await klingo.identify_user(phone, birthday_iso)
+    if ident.get("access_token"):
+        await _store_token(key, ident["access_token"])
+    return ident
+
+
+def _consume_exception(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception()
+
+
+def start_identify(phone: str, birthday_iso: str) -> None:
+    """Dispara a identificação sem aguardar (idempotente por identidade)."""
+    key = identity_key(phone, birthday_iso)
+    if key in _identify_tasks:
+        return
+    task = asyncio.get_running_loop().create_task(_identify(key, phone, birthday_iso))
+    task.add_done_callback(_consume_exception)
+    _identify_tasks[key] = task
+
+
+async def identify(phone: str, birthday_iso: str) -> Dict[str, Any]:
+    """Resultado da identificação: token em cache, chamada especulativa ou Klingo."""
+    start_identify(phone, birthday_iso)
+    key = identity_key(phone, birthday_iso)
+    task = _identify_tasks[key]
+    try:
+        # a tarefa especulativa não tem prazo; quem aguarda respeita o do turno
+        return await asyncio.wait_for(asyncio.shield(task), join_timeout())
+    except (asyncio.TimeoutError, TimeoutError) as e:
+        # a chamada segue em background: o próximo turno ainda pode aproveitá-la
+        raise klingo.KlingoError(504, f"timeout: {e}") from e
+    except Exception:
+        # falha não fica em cache: a próxima tentativa chama a Klingo de novo
+        if _identify_tasks.get(key) is task:
+            del _identify_tasks[key]
+        raise
@@ -0,0 +1,164 @@
+from __future__ import annotations
+import asyncio
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Iterator, Optional, TypeVar
+
+import httpx
+
+from app.config import settings
+
+# Resiliência para parceiros (Klingo, Asaas):
+# - orçamento de tempo por turno (contextvar): nenhuma chamada passa do prazo do turno
+# - retries com backoff exponencial + jitter, só quando é seguro repetir
+# - circuit breaker por parceiro: falha rápido enquanto o parceiro está degradado
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class BudgetExceeded(TimeoutError):
+    pass
+
+
+# -----------------------------------------------------------------------------
+# Orçamento por turno
+# -----------------------------------------------------------------------------
+_deadline: ContextVar[Optional[float]] = ContextVar("otinho_turn_deadline", default=None)
+
+
+@contextmanager
+def turn_budget(seconds: float) -> Iterator[None]:
+    """Prazo total para as chamadas externas feitas dentro do bloco."""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def detach_budget() -> None:
+    """Tarefas de background não herdam o prazo do turno que as criou."""
+    _deadline.set(None)
+
+
+def remaining(default: float) -> float:
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise BudgetExceeded("orçamento de tempo do turno esgotado")
+    return min(default, left)
+
+
+def join_timeout() -> Optional[float]:
+    """Espera máxima ao aguardar trabalho compartilhado (single-flight, especulativo): o prazo do turno."""
+    if _deadline.get() is None:
+        return None
+    return remaining(float(settings.request_timeout_seconds))
+
+
+# -----------------------------------------------------------------------------
+# Circuit breaker
+# -----------------------------------------------------------------------------
+class CircuitBreaker:
+    """closed -> (N falhas seguidas) -> open -> (reset_seconds) -> half-open (1 sonda)."""
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def before_call(self) -> None:
+        state = self.state
+        if state == "open" or (state == "half-open" and self._probing):
+            raise CircuitOpenError(f"{self.name}: circuito aberto")
+        if state == "half-open":
+            self._probing = True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release_probe(self) -> None:
+        """Chamada terminou sem veredito (cancelada): libera a sonda do half-open."""
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self._probing = False
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+# -----------------------------------------------------------------------------
+# Retries
+# -----------------------------------------------------------------------------
+# erros em que a requisição com certeza não chegou ao parceiro: sempre seguro repetir
+NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full jitter: uniforme entre 0 e base * 2^tentativa (limitado)."""
+    cap = min(settings.retry_max_delay_seconds, settings.retry_base_delay_seconds * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+async def resilient_call(
+    fn: Callable[[float], Awaitable[T]],
+    *,
+    breaker: CircuitBreaker,
+    idempotent: bool,
+    is_failure: Callable[[BaseException], bool],
+    attempts: Optional[int] = None,
+) -> T:
+    """
+    Executa fn(timeout) respeitando breaker, orçamento do turno e retries.
+    `is_failure` diz se a exceção indica parceiro degradado (conta no breaker e
+    permite retry de chamadas idempotentes); erros de negócio (4xx) não contam.
+    """
+    attempts = attempts or settings.retry_attempts
+    for attempt in range(attempts):
+        # prazo antes do breaker: BudgetExceeded aqui não pode prender a sonda half-open
+        timeout = remaining(float(settings.request_timeout_seconds))
+        breaker.before_call()
+        try:
+            result = await fn(timeout)
+        except Exception as exc:
+            degraded = isinstance(exc, httpx.TransportError) or is_failure(exc)
+            if degraded:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            retry = isinstance(exc, NOT_SENT) or (idempotent and degraded)
+            if not retry or attempt == attempts - 1:
+                raise
+            delay = backoff_delay(attempt)
+            if delay >= remaining(float("inf")):
+                raise
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            breaker.release_probe()  # CancelledError etc.: sem sucesso nem falha
+            raise
+        breaker.record_success()
+        return result
+    raise AssertionError("unreachable")
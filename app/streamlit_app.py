@@ -1,11 +1,18 @@
 from __future__ import annotations
 import sys
+import atexit
 import asyncio
+import threading
 import streamlit as st
 from app.db.session import engine
 from app.db import models
 from app.agent.state import AgentVars
 from app.agent.agent import agent_controller
+from app.agent import agenda
+from app.db.redis import close_redis
+from app.services import klingo
+from app.config import settings
+from app.utils import metrics
 
 # ---- FIX para Windows (evita conflitos de event loop) ----
 if sys.platform.startswith("win"):
@@ -16,6 +23,32 @@ if sys.platform.startswith("win"):
 
 st.set_page_config(page_title="Otinho – OtorrinoMed", page_icon="👂", layout="centered")
 
+# --------- EVENT LOOP do processo (mantém pools de conexão entre turnos) ----------
+async def _shutdown_async():
+    await metrics.stop_exporters()
+    await agenda.stop_refreshers()
+    await klingo.shutdown()
+    await close_redis()
+
+@st.cache_resource
+def _event_loop() -> asyncio.AbstractEventLoop:
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="otinho-loop", daemon=True).start()
+    asyncio.run_coroutine_threadsafe(klingo.startup(), loop).result()
+    asyncio.run_coroutine_threadsafe(agenda.prefetch_agendas(), loop)  # não bloqueia a UI
+    loop.call_soon_threadsafe(agenda.start_invalidation_listener)
+    asyncio.run_coroutine_threadsafe(
+        metrics.start_exporters(
+            settings.metrics_host, settings.metrics_port, settings.metrics_log_interval_seconds
+        ),
+        loop,
+    ).result()
+    atexit.register(lambda: asyncio.run_coroutine_threadsafe(_shutdown_async(), loop).result(5))
+    return loop
+
+def run_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop()).result()
+
 # --------- INIT DB (apenas 1x por processo) ----------
 async def _init_db_async():
     async with engine.begin() as conn:
@@ -23,7 +56,7 @@ async def _init_db_async():
 
 @st.cache_resource
 def init_db_once() -> bool:
-    asyncio.run(_init_db_async())
+    run_async(_init_db_async())
     return True
 
 init_db_once()
@@ -44,12 +77,13 @@ for msg in st.session_state.messages:
 
 prompt = st.chat_input("Digite sua mensagem...")
 
-async def handle_user_input(user_text: str):
+def handle_user_input(user_text: str):
     st.session_state.messages.append({"role": "user", "content": user_text})
     with st.chat_message("assistant"):
-        reply = await agent_controller(st.session_state.vars, user_text)  # <-- vars (com 's') + parênteses ok
+        # o turno roda no loop do processo; a UI do Streamlit fica nesta thread
+        reply = run_async(agent_controller(st.session_state.vars, user_text))  # <-- vars (com 's') + parênteses ok
         st.session_state.messages.append({"role": "assistant", "content": reply})
         st.markdown(reply)
 
 if prompt:
-    asyncio.run(handle_user_input(prompt))
+    handle_user_input(prompt)
@@ -1,46 +1,71 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Tuple
-from collections import defaultdict
-from app.utils.validators import is_br_holiday, is_sunday, is_today
+from bisect import insort
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+from app.utils.validators import FLAG_BLOCKED, classify_dates
 
 # Entrada: payload da Klingo /agenda/horarios
 # Saída: estrutura reduzida e filtrada
+# max_dates / max_times = None mantém o horizonte completo (paginação fica com a FSM)
 
-def filter_slots(payload: Dict[str, Any]) -> Dict[str, Any]:
+def filter_slots(
+    payload: Dict[str, Any],
+    max_dates: Optional[int] = 3,
+    max_times: Optional[int] = 5,
+) -> Dict[str, Any]:
     horarios: List[Dict[str, Any]] = payload.get("horarios", [])
-    result: Dict[str, Dict[str, List[Tuple[str, str]]]] = defaultdict(lambda: defaultdict(list))
+    # médico -> (nome, datas ordenadas [top N], data -> [(id_completo, "HH:MM"), ...])
+    acc: Dict[str, Tuple[str, List[str], Dict[str, List[Tuple[str, str]]]]] = {}
+    # passada prévia: cada data distinta é classificada uma única vez (hoje, domingo, feriado)
+    flags = classify_dates(d for d in (item.get("data") for item in horarios) if d)
 
-    # agrega por medico -> data -> [horas]
+    # passada de agregação: filtra, agrega e mantém só as N menores datas por médico
     for item in horarios:
         date_iso = item.get("data")
-        prof = item.get("profissional", {})
-        doctor_name = prof.get("nome")
-        doctor_id = str(prof.get("id"))
-        times: Dict[str, str] = item.get("horarios", {})
-
+        if not date_iso:
+            continue
         # filtros de data proibida
-        if not date_iso or is_today(date_iso) or is_sunday(date_iso) or is_br_holiday(date_iso):
+        if flags[date_iso] & FLAG_BLOCKED:
             continue
 
-        # coleta 5 primeiros horários disponíveis da data
-        top_times = list(times.items())[:5]  # [(id_completo, "HH:MM"), ...]
-        if not top_times:
+        times: Dict[str, str] = item.get("horarios", {})
+        if not times:
             continue
 
-        result[(doctor_id, doctor_name)][date_iso].extend(top_times)
+        prof = item.get("profissional", {})
+        doctor_id = str(prof.get("id"))
+        entry = acc.get(doctor_id)
+        if entry is None:
+            entry = acc[doctor_id] = (prof.get("nome"), [], {})
+        _, dates, by_date = entry
+
+        current = by_date.get(date_iso)
+        if current is None:
+            # data nova: entra só se couber entre as N menores
+            if max_dates is None:
+                dates.append(date_iso)  # ordenadas uma vez no final
+            else:
+                if len(dates) >= max_dates:
+                    if date_iso > dates[-1]:
+                        continue
+                    del by_date[dates.pop()]
+                insort(dates, date_iso)
+            current = by_date[date_iso] = []
+
+        # coleta os primeiros horários disponíveis da data (sem materializar o resto)
+        room = None if max_times is None else max_times - len(current)
+        if room is None or room > 0:
+            current.extend(islice(times.items(), room))
 
-    # reduz para top 3 datas por médico, top 5 horários por data (já limitado)
     reduced: Dict[str, Any] = {}
-    for (doctor_id, doctor_name), dates_map in result.items():
-        dates_sorted = sorted(dates_map.keys())[:3]
+    for doctor_id, (doctor_name, dates, by_date) in acc.items():
+        if max_dates is None:
+            dates.sort()
         reduced[doctor_id] = {
             "doctor_name": doctor_name,
             "dates": [
-                {
-                    "date": d,
-                    "times": [{"slot_id": sid, "time": t} for sid, t in dates_map[d][:5]],
-                }
-                for d in dates_sorted
+                {"date": d, "times": [{"slot_id": sid, "time": t} for sid, t in by_date[d]]}
+                for d in dates
             ],
         }
     return {"doctors": reduced}
@@ -0,0 +1,93 @@
+from __future__ import annotations
+from datetime import date, timedelta
+from typing import Dict, Iterable, Set
+from app.config import settings
+
+# Feriados calculados para qualquer ano: nacionais fixos + móveis (derivados da Páscoa),
+# mais datas configuráveis (estaduais/municipais e fechamentos da clínica).
+# Entradas "mm-dd" repetem todo ano; "yyyy-mm-dd" valem só naquela data.
+
+NATIONAL_FIXED = (
+    (1, 1, "Confraternização Universal"),
+    (4, 21, "Tiradentes"),
+    (5, 1, "Dia do Trabalhador"),
+    (9, 7, "Independência"),
+    (10, 12, "Nossa Senhora Aparecida"),
+    (11, 2, "Finados"),
+    (11, 15, "Proclamação da República"),
+    (12, 25, "Natal"),
+)
+
+# dias relativos ao domingo de Páscoa
+EASTER_OFFSETS = (
+    (-48, "Carnaval (segunda-feira)"),
+    (-47, "Carnaval (terça-feira)"),
+    (-2, "Sexta-feira Santa"),
+    (60, "Corpus Christi"),
+)
+
+
+def easter_sunday(year: int) -> date:
+    """Domingo de Páscoa (calendário gregoriano, algoritmo de Meeus/Jones/Butcher)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    wd = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * wd) // 451
+    month, day = divmod(h + wd - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def br_holidays(year: int) -> Dict[date, str]:
+    """Feriados nacionais do ano (fixos + móveis)."""
+    out = {date(year, m, d): name for m, d, name in NATIONAL_FIXED}
+    if year >= 2024:
+        out[date(year, 11, 20)] = "Dia Nacional de Zumbi e da Consciência Negra"
+    easter = easter_sunday(year)
+    for offset, name in EASTER_OFFSETS:
+        out[easter + timedelta(days=offset)] = name
+    return out
+
+
+class HolidayCalendar:
+    """
+    Conjunto de ordinais de datas fechadas. Os anos são materializados sob
+    demanda, então a consulta é O(1) para qualquer ano.
+    """
+
+    def __init__(self, extra_dates: Iterable[str] = ()) -> None:
+        self._recurring: Set[tuple[int, int]] = set()
+        self._one_off: Set[int] = set()
+        for raw in extra_dates:
+            raw = raw.strip()
+            if len(raw) == 5:  # mm-dd
+                m, d = raw.split("-")
+                self._recurring.add((int(m), int(d)))
+            else:
+                self._one_off.add(date.fromisoformat(raw).toordinal())
+        self._ordinals: Set[int] = set(self._one_off)
+        self._years: Set[int] = set()
+
+    def _load_year(self, year: int) -> None:
+        self._ordinals.update(d.toordinal() for d in br_holidays(year))
+        for m, d in self._recurring:
+            try:
+                self._ordinals.add(date(year, m, d).toordinal())
+            except ValueError:  # 02-29 em ano não bissexto
+                pass
+        self._years.add(year)
+
+    def is_closed(self, day: date) -> bool:
+        if day.year not in self._years:
+            self._load_year(day.year)
+        return day.toordinal() in self._ordinals
+
+    def __contains__(self, date_iso: str) -> bool:
+        return self.is_closed(date.fromisoformat(date_iso))
+
+
+holiday_calendar = HolidayCalendar([*settings.extra_holidays, *settings.clinic_closures])
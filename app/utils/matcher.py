@@ -0,0 +1,167 @@
+from __future__ import annotations
+import re
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple
+from app.config import settings
+
+# Índice de nomes de médicos, construído uma vez por refresh da agenda.
+# Consulta em tempo proporcional ao tamanho da mensagem:
+# - trie por tokens para nomes completos/multi-token ("joao pedro lima")
+# - índice invertido token -> médicos para menções parciais ("dr lima")
+# - trigramas + distância de edição limitada para erros de digitação ("marsia")
+# Empates entre médicos diferentes não são resolvidos por ordem: retornam None.
+
+TITLES = {"dr", "dra", "doutor", "doutora"}
+PARTICLES = {"de", "da", "do", "das", "dos", "e"}
+# palavras comuns nas mensagens que nunca devem virar nome por aproximação
+MESSAGE_WORDS = {
+    "quero", "prefiro", "pode", "para", "favor", "medico", "medica", "consulta",
+    "com", "sim", "nao", "qualquer", "outro", "outra", "esse", "essa",
+}
+FUZZY_MIN_LEN = 4
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def fold(text: str) -> str:
+    """Minúsculas, sem acentos e sem pontuação: "Dra. Márcia" -> "dra marcia"."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    ascii_ = "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+    return _NON_WORD.sub(" ", ascii_).strip()
+
+
+def name_tokens(text: str) -> List[str]:
+    return [t for t in fold(text).split() if t not in TITLES and t not in PARTICLES]
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein com corte: retorna limit + 1 assim que a distância passa do limite."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        cur = [i]
+        for j, cb in enumerate(b, start=1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+_END = ""  # chave terminal na trie
+
+
+class DoctorMatcher:
+    __slots__ = ("names", "min_similarity", "_index", "_trie", "_grams")
+
+    def __init__(self, names: Dict[str, str], min_similarity: Optional[float] = None) -> None:
+        self.names = names  # doctor_id -> nome exibido
+        self.min_similarity = (
+            settings.doctor_match_min_similarity if min_similarity is None else min_similarity
+        )
+        self._index: Dict[str, Set[str]] = {}
+        self._trie: Dict[str, dict] = {}
+        self._grams: Dict[str, Set[str]] = {}  # trigrama -> tokens de nomes
+        for did, name in names.items():
+            tokens = name_tokens(name)
+            for tok in tokens:
+                self._index.setdefault(tok, set()).add(did)
+            if tokens:
+                node = self._trie
+                for tok in tokens:
+                    node = node.setdefault(tok, {})
+                node.setdefault(_END, set()).add(did)
+        for tok in self._index:
+            if len(tok) >= FUZZY_MIN_LEN:
+                for g in trigrams(tok):
+                    self._grams.setdefault(g, set()).add(tok)
+
+    @classmethod
+    def from_doctors(cls, doctors: Dict[str, Dict]) -> "DoctorMatcher":
+        return cls({did: d.get("doctor_name") or "" for did, d in doctors.items()})
+
+    def _fuzzy(self, token: str) -> Optional[Tuple[str, float]]:
+        """Token de nome mais parecido (e sua similaridade), se único e acima do limiar."""
+        if len(token) < FUZZY_MIN_LEN or token in MESSAGE_WORDS:
+            return None
+        shared: Dict[str, int] = {}
+        for g in trigrams(token):
+            for cand in self._grams.get(g, ()):
+                shared[cand] = shared.get(cand, 0) + 1
+        best: Optional[str] = None
+        best_sim, tied = 0.0, False
+        for cand in shared:
+            size = max(len(token), len(cand))
+            limit = int(size * (1 - self.min_similarity))
+            dist = bounded_distance(token, cand, limit)
+            if dist > limit:
+                continue
+            sim = 1 - dist / size
+            if sim > best_sim:
+                best, best_sim, tied = cand, sim, False
+            elif sim == best_sim:
+                tied = True
+        if best is None or tied or best_sim < self.min_similarity:
+            return None
+        return best, best_sim
+
+    def _resolve(self, text: str) -> List[Tuple[str, float]]:
+        # tokens da mensagem -> tokens de nomes conhecidos (exatos = 1.0; aproximados < 1.0)
+        out: List[Tuple[str, float]] = []
+        for tok in name_tokens(text):
+            if tok in self._index:
+                out.append((tok, 1.0))
+            else:
+                hit = self._fuzzy(tok)
+                if hit:
+                    out.append(hit)
+        return out
+
+    def _full_name_hits(self, tokens: List[str]) -> Set[str]:
+        # nomes completos citados; o mais longo vence ("ana lima souza" > "ana lima")
+        hits: Set[str] = set()
+        longest = 0
+        for i in range(len(tokens)):
+            node = self._trie
+            for depth, tok in enumerate(tokens[i:], start=1):
+                node = node.get(tok)
+                if node is None:
+                    break
+                if _END in node:
+                    if depth > longest:
+                        hits, longest = set(node[_END]), depth
+                    elif depth == longest:
+                        hits |= node[_END]
+        return hits
+
+    def _scores(self, resolved: List[Tuple[str, float]]) -> Dict[str, Tuple[float, float]]:
+        # (confiança somada dos tokens citados, especificidade 1/nº de médicos com o token)
+        scores: Dict[str, Tuple[float, float]] = {}
+        for tok, conf in dict(resolved).items():
+            dids = self._index[tok]
+            weight = conf / len(dids)
+            for did in dids:
+                n, w = scores.get(did, (0.0, 0.0))
+                scores[did] = (n + conf, w + weight)
+        return scores
+
+    def candidates(self, text: str) -> List[str]:
+        """Médicos com a melhor pontuação para a mensagem (vários = ambíguo)."""
+        resolved = self._resolve(text)
+        if not resolved:
+            return []
+        full = self._full_name_hits([tok for tok, _ in resolved])
+        if full:
+            return sorted(full)
+        scores = self._scores(resolved)
+        best = max(scores.values())
+        return sorted(did for did, s in scores.items() if s == best)
+
+    def match(self, text: str) -> Optional[str]:
+        found = self.candidates(text)
+        return found[0] if len(found) == 1 else None
@@ -0,0 +1,208 @@
+from __future__ import annotations
+import asyncio
+import functools
+import json
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+# Histogramas de latência e contadores em memória (por processo).
+# Crie o histograma uma vez (import/registro) e chame observe() no caminho quente:
+# cada amostra é só um bisect + incrementos, sem alocar estruturas novas.
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0,
+)
+
+T = TypeVar("T")
+logger = logging.getLogger("otinho.metrics")
+
+
+class Histogram:
+    __slots__ = ("name", "help", "labels", "bounds", "counts", "sum", "count")
+
+    def __init__(self, name: str, help: str, labels: Dict[str, str], bounds: Tuple[float, ...]) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.bounds = bounds
+        self.counts: List[int] = [0] * (len(bounds) + 1)  # último = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "metric": self.name,
+            **self.labels,
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "buckets": dict(zip([*map(str, self.bounds), "+Inf"], self.counts)),
+        }
+
+
+class Counter:
+    __slots__ = ("name", "help", "labels", "value")
+
+    def __init__(self, name: str, help: str, labels: Dict[str, str]) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, n: int = 1) -> None:
+        self.value += n
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"metric": self.name, **self.labels, "value": self.value}
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._hists: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Counter] = {}
+
+    def histogram(
+        self, name: str, help: str = "", buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels: str
+    ) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        h = self._hists.get(key)
+        if h is None:
+            h = self._hists[key] = Histogram(name, help, dict(labels), tuple(buckets))
+        return h
+
+    def counter(self, name: str, help: str = "", **labels: str) -> Counter:
+        key = (name, tuple(sorted(labels.items())))
+        c = self._counters.get(key)
+        if c is None:
+            c = self._counters[key] = Counter(name, help, dict(labels))
+        return c
+
+    def histograms(self) -> List[Histogram]:
+        return list(self._hists.values())
+
+    def counters(self) -> List[Counter]:
+        return list(self._counters.values())
+
+    def render_prometheus(self) -> str:
+        """Formato texto de exposição do Prometheus (buckets cumulativos)."""
+        lines: List[str] = []
+        seen = set()
+        for h in sorted(self._hists.values(), key=lambda h: h.name):
+            if h.name not in seen:
+                seen.add(h.name)
+                lines.append(f"# HELP {h.name} {h.help}")
+                lines.append(f"# TYPE {h.name} histogram")
+            base = ",".join(f'{k}="{v}"' for k, v in h.labels.items())
+            sep = "," if base else ""
+            cumulative = 0
+            for bound, n in zip([*map(repr, h.bounds), "+Inf"], h.counts):
+                cumulative += n
+                lines.append(f'{h.name}_bucket{{{base}{sep}le="{bound}"}} {cumulative}')
+            suffix = f"{{{base}}}" if base else ""
+            lines.append(f"{h.name}_sum{suffix} {h.sum}")
+            lines.append(f"{h.name}_count{suffix} {h.count}")
+        for c in sorted(self._counters.values(), key=lambda c: c.name):
+            if c.name not in seen:
+                seen.add(c.name)
+                lines.append(f"# HELP {c.name} {c.help}")
+                lines.append(f"# TYPE {c.name} counter")
+            base = ",".join(f'{k}="{v}"' for k, v in c.labels.items())
+            lines.append(f"{c.name}{{{base}}} {c.value}" if base else f"{c.name} {c.value}")
+        return "\n".join(lines) + "\n"
+
+    def log_snapshot(self, log: logging.Logger = logger) -> None:
+        """Uma linha JSON por métrica (para coleta periódica, não por amostra)."""
+        for m in [*self._hists.values(), *self._counters.values()]:
+            log.info(json.dumps(m.snapshot(), ensure_ascii=False))
+
+
+registry = MetricsRegistry()
+histogram = registry.histogram
+counter = registry.counter
+render_prometheus = registry.render_prometheus
+log_snapshot = registry.log_snapshot
+
+
+def timed(hist: Histogram) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Decorator para corrotinas: registra a duração (inclusive em erro) em `hist`."""
+    def decorator(fn: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            t0 = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - t0)
+        return wrapper
+    return decorator
+
+
+# -----------------------------------------------------------------------------
+# Exportação: endpoint HTTP (Prometheus) e snapshot periódico em log JSON
+# -----------------------------------------------------------------------------
+_exporters: List[Any] = []  # servidor e tarefa de log ativos (para o shutdown)
+
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5.0)
+        path = request.split(b" ", 2)[1] if request.count(b" ") >= 2 else b""
+        if path.split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", render_prometheus().encode("utf-8")
+        else:
+            status, body = "404 Not Found", b"use /metrics\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body
+        )
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+
+async def _log_forever(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        log_snapshot()
+
+
+async def start_exporters(host: str, port: Optional[int], log_interval: float) -> None:
+    """
+    No loop do processo: GET http://host:port/metrics (formato texto do Prometheus)
+    e, a cada `log_interval` segundos, uma linha JSON por métrica no logger
+    "otinho.metrics". port=None / log_interval<=0 desligam cada um.
+    """
+    if port is not None:
+        try:
+            _exporters.append(await asyncio.start_server(_handle_scrape, host, port))
+        except OSError as e:
+            # porta ocupada (ex.: outro worker no host): segue sem o endpoint, o worker atende
+            logger.warning("metrics: endpoint /metrics desligado (%s:%s): %s", host, port, e)
+    if log_interval > 0:
+        if not logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+        _exporters.append(asyncio.get_running_loop().create_task(_log_forever(log_interval)))
+
+
+async def stop_exporters() -> None:
+    items = list(_exporters)
+    _exporters.clear()
+    for item in items:
+        if isinstance(item, asyncio.Task):
+            item.cancel()
+            await asyncio.gather(item, return_exceptions=True)
+        else:
+            item.close()
+            await item.wait_closed()
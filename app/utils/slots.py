@@ -0,0 +1,109 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple
+from app.utils.matcher import DoctorMatcher
+
+# Índice em memória da agenda reduzida ({"doctors": {id: {"dates": [...]}}}).
+# Construído uma vez por refresh; lookups por (médico, data, hora) em O(1).
+
+
+class Slot:
+    __slots__ = ("slot_id", "doctor_id", "date", "time")
+
+    def __init__(self, slot_id: str, doctor_id: str, date: str, time: str) -> None:
+        self.slot_id = slot_id
+        self.doctor_id = doctor_id
+        self.date = date  # yyyy-mm-dd
+        self.time = time  # HH:MM
+
+    def __repr__(self) -> str:
+        return f"Slot({self.doctor_id}, {self.date} {self.time})"
+
+
+class DoctorSlots:
+    __slots__ = ("doctor_id", "doctor_name", "dates", "times")
+
+    def __init__(self, doctor_id: str, doctor_name: str) -> None:
+        self.doctor_id = doctor_id
+        self.doctor_name = doctor_name
+        self.dates: List[str] = []  # ordenadas
+        self.times: Dict[str, List[str]] = {}  # data -> horários ordenados
+
+
+class SlotStore:
+    __slots__ = ("source", "doctors", "_by_key", "_by_id", "_matcher")
+
+    def __init__(self) -> None:
+        self.source: Dict[str, Any] = {}  # agenda reduzida de origem (identidade)
+        self.doctors: Dict[str, DoctorSlots] = {}
+        self._by_key: Dict[Tuple[str, str, str], Slot] = {}
+        self._by_id: Dict[str, Slot] = {}
+        self._matcher: Optional[DoctorMatcher] = None
+
+    @classmethod
+    def from_reduced(cls, reduced: Dict[str, Any]) -> "SlotStore":
+        store = cls()
+        store.source = reduced
+        for did, d in reduced.get("doctors", {}).items():
+            doc = DoctorSlots(did, d.get("doctor_name"))
+            for e in d.get("dates", []):
+                date = e["date"]
+                times = doc.times.setdefault(date, [])
+                for t in e.get("times", []):
+                    slot = Slot(t["slot_id"], did, date, t["time"])
+                    store._by_key[(did, date, slot.time)] = slot
+                    store._by_id[slot.slot_id] = slot
+                    times.append(slot.time)
+            for times in doc.times.values():
+                times.sort()
+            doc.dates = sorted(doc.times)
+            store.doctors[did] = doc
+        return store
+
+    @property
+    def matcher(self) -> DoctorMatcher:
+        """Índice de nomes dos médicos desta agenda (construído no primeiro uso)."""
+        if self._matcher is None:
+            self._matcher = DoctorMatcher({did: d.doctor_name or "" for did, d in self.doctors.items()})
+        return self._matcher
+
+    def has_doctor(self, doctor_id: str) -> bool:
+        return doctor_id in self.doctors
+
+    def dates(self, doctor_id: str) -> List[str]:
+        doc = self.doctors.get(doctor_id)
+        return doc.dates if doc else []
+
+    def times(self, doctor_id: str, date_iso: str) -> List[str]:
+        doc = self.doctors.get(doctor_id)
+        return doc.times.get(date_iso, []) if doc else []
+
+    def find(self, doctor_id: str, date_iso: str, time_: str) -> Optional[Slot]:
+        return self._by_key.get((doctor_id, date_iso, time_))
+
+    def get(self, slot_id: str) -> Optional[Slot]:
+        return self._by_id.get(slot_id)
+
+    def remove(self, slot_id: str) -> bool:
+        """Tira o slot do índice e da agenda de origem (ex.: acabou de ser agendado)."""
+        slot = self._by_id.pop(slot_id, None)
+        if slot is None:
+            return False
+        self._by_key.pop((slot.doctor_id, slot.date, slot.time), None)
+        doc = self.doctors.get(slot.doctor_id)
+        if doc is not None:
+            times = doc.times.get(slot.date, [])
+            if slot.time in times:
+                times.remove(slot.time)
+            if not times:
+                doc.times.pop(slot.date, None)
+                doc.dates = [d for d in doc.dates if d != slot.date]
+        src = self.source.get("doctors", {}).get(slot.doctor_id)
+        if src is not None:
+            for e in src.get("dates", []):
+                if e["date"] == slot.date:
+                    e["times"] = [t for t in e["times"] if t["slot_id"] != slot_id]
+            src["dates"] = [e for e in src.get("dates", []) if e["times"]]
+        return True
+
+    def __len__(self) -> int:
+        return len(self._by_id)
@@ -1,23 +1,13 @@
 from __future__ import annotations
 import re
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable
+from app.utils.holidays import HolidayCalendar, holiday_calendar
 
 CPF_REGEX = re.compile(r"^\d{11}$")
 PHONE_REGEX = re.compile(r"^\d{11,}$")
 DATE_ISO_REGEX = re.compile(r"^\d{4}-\d{2}-\d{2}$")
 
-BR_HOLIDAYS_2025 = {
-    "2025-01-01",  # Confraternização Universal
-    "2025-04-18",  # Sexta-feira Santa
-    "2025-04-21",  # Tiradentes
-    "2025-05-01",  # Dia do Trabalhador
-    "2025-09-07",  # Independência
-    "2025-10-12",  # Nossa Senhora Aparecida
-    "2025-11-02",  # Finados
-    "2025-11-15",  # Proclamação da República
-    "2025-12-25",  # Natal
-}
-
 def sanitize_digits(value: str) -> str:
     return re.sub(r"\D+", "", value or "")
 
@@ -45,11 +35,90 @@ def to_iso_date(date_str: str) -> str:
     except Exception:
         raise ValueError("Data inválida; use dd/mm/aaaa ou yyyy-mm-dd")
 
+# -----------------------------------------------------------------------------
+# Calendário de datas: "yyyy-mm-dd" -> bitmask, pré-calculado e refeito na virada do dia
+# -----------------------------------------------------------------------------
+FLAG_TODAY = 1
+FLAG_SUNDAY = 2
+FLAG_HOLIDAY = 4
+FLAG_BLOCKED = FLAG_TODAY | FLAG_SUNDAY | FLAG_HOLIDAY  # datas que nunca oferecemos
+
+class DateCalendar:
+    """
+    Classifica datas com um lookup em dict. A tabela cobre os próximos
+    `horizon_days` dias e é reconstruída quando "hoje" muda (UTC); datas
+    fora da janela são calculadas uma vez e memorizadas.
+    É a única fonte de "hoje": use freeze() em testes e benchmarks.
+    """
+
+    def __init__(self, holidays: HolidayCalendar, horizon_days: int = 400) -> None:
+        self.holidays = holidays
+        self.horizon_days = horizon_days
+        self._frozen: date | None = None
+        self._day: date | None = None
+        self._flags: Dict[str, int] = {}
+
+    def today(self) -> date:
+        return self._frozen or datetime.utcnow().date()
+
+    def freeze(self, day: date | str | None) -> None:
+        """Fixa "hoje" (None volta ao relógio)."""
+        self._frozen = date.fromisoformat(day) if isinstance(day, str) else day
+        self._day = None
+
+    def _compute(self, date_iso: str) -> int:
+        d = datetime.fromisoformat(date_iso).date()
+        flags = 0
+        if d == self._day:
+            flags |= FLAG_TODAY
+        if d.weekday() == 6:  # 0=mon .. 6=sun
+            flags |= FLAG_SUNDAY
+        if self.holidays.is_closed(d):
+            flags |= FLAG_HOLIDAY
+        return flags
+
+    def _sync(self) -> Dict[str, int]:
+        day = self.today()
+        if day != self._day:
+            self._day = day
+            self._flags = {}
+            for i in range(self.horizon_days):
+                iso = (day + timedelta(days=i)).isoformat()
+                self._flags[iso] = self._compute(iso)
+        return self._flags
+
+    def flags(self, date_iso: str) -> int:
+        table = self._sync()
+        f = table.get(date_iso)
+        if f is None:
+            f = table[date_iso] = self._compute(date_iso)
+        return f
+
+    def classify_dates(self, dates: Iterable[str]) -> Dict[str, int]:
+        table = self._sync()  # "hoje" resolvido uma vez para o lote
+        out: Dict[str, int] = {}
+        for d in dates:
+            if d in out:
+                continue
+            f = table.get(d)
+            if f is None:
+                f = table[d] = self._compute(d)
+            out[d] = f
+        return out
+
+date_calendar = DateCalendar(holiday_calendar)
+
+def classify_dates(dates: Iterable[str]) -> Dict[str, int]:
+    return date_calendar.classify_dates(dates)
+
+def freeze_today(day: date | str | None) -> None:
+    date_calendar.freeze(day)
+
 def is_sunday(date_iso: str) -> bool:
-    return datetime.fromisoformat(date_iso).weekday() == 6  # 0=mon .. 6=sun
+    return bool(date_calendar.flags(date_iso) & FLAG_SUNDAY)
 
 def is_today(date_iso: str) -> bool:
-    return datetime.fromisoformat(date_iso).date() == datetime.utcnow().date()
+    return bool(date_calendar.flags(date_iso) & FLAG_TODAY)
 
 def is_br_holiday(date_iso: str) -> bool:
-    return date_iso in BR_HOLIDAYS_2025
+    return bool(date_calendar.flags(date_iso) & FLAG_HOLIDAY)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+os.environ.setdefault("KLINGO_APP_TOKEN", "test")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+# reaproveita a implementação de referência e o gerador de payloads dos testes
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
@@ -0,0 +1,27 @@
+"""
+filter_slots atual x implementação anterior sobre payloads sintéticos.
+Rode com: python -m pytest benchmarks (requer o extra "dev", pytest-benchmark).
+"""
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app.utils.filters import filter_slots  # noqa: E402
+from filters_reference import filter_slots_reference, synthetic_payload  # noqa: E402
+
+SIZES = [1_000, 10_000, 100_000]
+MODES = {"top": {}, "full": {"max_dates": None, "max_times": None}}
+IMPLEMENTATIONS = {"filter_slots": filter_slots, "reference": filter_slots_reference}
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda n: f"{n // 1000}k")
+def payload(request):
+    return synthetic_payload(request.param)
+
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("impl", IMPLEMENTATIONS)
+def test_filter_slots(benchmark, payload, impl, mode):
+    benchmark.group = f"filter_slots-{mode}-{len(payload['horarios'])}"
+    result = benchmark(IMPLEMENTATIONS[impl], payload, **MODES[mode])
+    assert result == filter_slots_reference(payload, **MODES[mode])
@@ -0,0 +1,5 @@
+import os
+
+# Settings exige o token da Klingo; os testes nunca chamam a API real nem o Postgres
+os.environ.setdefault("KLINGO_APP_TOKEN", "test")
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
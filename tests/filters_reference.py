@@ -0,0 +1,82 @@
+from __future__ import annotations
+import random
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils.holidays import holiday_calendar
+from app.utils.validators import date_calendar
+
+# filter_slots anterior à reescrita: referência de comportamento para os testes
+# de equivalência e base dos benchmarks. As checagens de data são as originais
+# (datetime.fromisoformat a cada item, sem a tabela memorizada do DateCalendar);
+# só a lista de feriados é a atual (HolidayCalendar), para o resultado ser comparável.
+
+
+def _is_sunday(date_iso: str) -> bool:
+    return datetime.fromisoformat(date_iso).weekday() == 6  # 0=mon .. 6=sun
+
+
+def _is_today(date_iso: str) -> bool:
+    return datetime.fromisoformat(date_iso).date() == date_calendar.today()
+
+
+def _is_br_holiday(date_iso: str) -> bool:
+    return holiday_calendar.is_closed(datetime.fromisoformat(date_iso).date())
+
+
+def filter_slots_reference(
+    payload: Dict[str, Any],
+    max_dates: Optional[int] = 3,
+    max_times: Optional[int] = 5,
+) -> Dict[str, Any]:
+    horarios: List[Dict[str, Any]] = payload.get("horarios", [])
+    result: Dict[str, Dict[str, List[Tuple[str, str]]]] = defaultdict(lambda: defaultdict(list))
+
+    for item in horarios:
+        date_iso = item.get("data")
+        prof = item.get("profissional", {})
+        doctor_name = prof.get("nome")
+        doctor_id = str(prof.get("id"))
+        times: Dict[str, str] = item.get("horarios", {})
+
+        if not date_iso or _is_today(date_iso) or _is_sunday(date_iso) or _is_br_holiday(date_iso):
+            continue
+
+        top_times = list(islice(times.items(), max_times))
+        if not top_times:
+            continue
+
+        result[(doctor_id, doctor_name)][date_iso].extend(top_times)
+
+    reduced: Dict[str, Any] = {}
+    for (doctor_id, doctor_name), dates_map in result.items():
+        dates_sorted = sorted(dates_map.keys())[:max_dates]
+        reduced[doctor_id] = {
+            "doctor_name": doctor_name,
+            "dates": [
+                {
+                    "date": d,
+                    "times": [{"slot_id": sid, "time": t} for sid, t in dates_map[d][:max_times]],
+                }
+                for d in dates_sorted
+            ],
+        }
+    return {"doctors": reduced}
+
+
+def synthetic_payload(n: int, seed: int = 1, doctors: int = 40, days: int = 120) -> Dict[str, Any]:
+    """Payload /agenda/horarios sintético: `n` itens (médico, data) com 0–19 horários."""
+    rnd = random.Random(seed)
+    base = date(2030, 1, 1)
+    items = []
+    for i in range(n):
+        d = (base + timedelta(days=rnd.randrange(days))).isoformat()
+        pid = rnd.randrange(doctors)
+        items.append({
+            "data": d,
+            "profissional": {"id": pid, "nome": f"Dr {pid}"},
+            "horarios": {f"{pid}-{d}-{i}-{h}": f"{h:02d}:00" for h in range(rnd.randrange(20))},
+        })
+    return {"horarios": items}
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+import pytest
+
+from app.agent import agenda
+from app.agent import agent as agent_module
+from app.agent.state import AgentVars, Step
+from app.config import settings
+from app.services import klingo, patients
+
+SLOW = 2.0
+BUDGET = 0.3
+
+
+@pytest.fixture
+def degraded_klingo(monkeypatch):
+    calls = []
+
+    async def slow(*args):
+        calls.append(args)
+        await asyncio.sleep(SLOW)
+        return {}
+
+    monkeypatch.setattr(klingo, "get_agenda", slow)
+    monkeypatch.setattr(klingo, "identify_user", slow)
+    monkeypatch.setattr(settings, "turn_budget_seconds", BUDGET)
+    monkeypatch.setattr(settings, "agenda_swr_enabled", False)
+    for cache in (agenda._agenda_cache, agenda._last_good, agenda._stores, patients._identify_tasks):
+        cache.clear()
+    return calls
+
+
+async def _timed(state: AgentVars, text: str):
+    t0 = time.monotonic()
+    reply = await agent_module.agent_controller(state, text)
+    return reply, time.monotonic() - t0
+
+
+def test_turn_joining_prefetch_respects_budget(degraded_klingo):
+    async def run():
+        state = AgentVars()
+        await agent_module.agent_controller(state, "oi")  # dispara o prefetch (sem prazo)
+        return await _timed(state, "dra marcia")
+
+    reply, elapsed = asyncio.run(run())
+    assert elapsed < SLOW / 2
+    assert "instável" in reply
+    assert len(degraded_klingo) == 1  # o turno aguardou o prefetch, não buscou de novo
+
+
+def test_turn_joining_speculative_identify_respects_budget(degraded_klingo):
+    async def run():
+        state = AgentVars()
+        state.current_step = Step.ASK_IDENTIFY
+        patients.start_identify("11987654321", "1990-01-31")  # especulativa, sem prazo
+        reply = await _timed(state, "11987654321 31/01/1990")
+        return reply, patients.identity_key("11987654321", "1990-01-31") in patients._identify_tasks
+
+    (_, elapsed), still_running = asyncio.run(run())
+    assert elapsed < SLOW / 2
+    assert still_running  # a chamada segue em background para o próximo turno
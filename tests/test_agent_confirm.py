@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from app.agent import agenda
+from app.agent import agent as agent_module
+from app.agent.state import AgentVars, Step
+from app.services import appointments, klingo
+
+PAYLOAD = {"horarios": [{
+    "data": "2030-04-09",
+    "profissional": {"id": 1, "nome": "Dra. Márcia Souza"},
+    "horarios": {"1-0900": "09:00", "1-0930": "09:30"},
+}]}
+
+
+@pytest.fixture
+def confirming(monkeypatch):
+    async def get_agenda(*args):
+        return PAYLOAD
+
+    async def no_db(*args):
+        raise ConnectionError("sem banco nos testes")
+
+    monkeypatch.setattr(klingo, "get_agenda", get_agenda)
+    monkeypatch.setattr(appointments, "_claim", no_db)
+    for cache in (agenda._agenda_cache, agenda._last_good, agenda._stores, agenda._booked):
+        cache.clear()
+    appointments._done.clear()
+    appointments._uncertain.clear()
+    state = AgentVars()
+
+    async def setup():
+        await agent_module.agent_controller(state, "oi")
+        await agent_module.agent_controller(state, "dra marcia")
+        await agent_module.agent_controller(state, "09/04/2030")
+        await agent_module.agent_controller(state, "09:00")
+
+    asyncio.run(setup())
+    state.user_token = "tok"
+    state.current_step = Step.ASK_CONFIRM_APPOINTMENT
+    return state
+
+
+def _confirm(monkeypatch, state, status, cause=None):
+    async def create(token, slot_id):
+        err = klingo.KlingoError(status, "x")
+        err.__cause__ = cause
+        raise err
+
+    monkeypatch.setattr(klingo, "create_appointment", create)
+    return asyncio.run(agent_module.agent_controller(state, "sim"))
+
+
+def test_slot_taken_goes_back_to_times(monkeypatch, confirming):
+    reply = _confirm(monkeypatch, confirming, 409)
+    assert confirming.current_step == Step.ASK_TIME
+    assert "09:30" in reply and "09:00" not in reply
+    assert "1-0900" in agenda._booked
+
+
+def test_outage_keeps_confirm_step(monkeypatch, confirming):
+    reply = _confirm(monkeypatch, confirming, 503)
+    assert confirming.current_step == Step.ASK_CONFIRM_APPOINTMENT
+    assert "instável" in reply
+
+
+@pytest.mark.parametrize("status", [400, 403, 404, 422])
+def test_other_client_errors_do_not_invalidate_slot(monkeypatch, confirming, status):
+    reply = _confirm(monkeypatch, confirming, status)
+    assert confirming.current_step == Step.ASK_CONFIRM_APPOINTMENT
+    assert "instável" in reply
+    assert "1-0900" not in agenda._booked
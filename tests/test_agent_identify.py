@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from app.agent import agent as agent_module
+from app.agent.state import AgentVars, Step
+from app.services import appointments, klingo, patients
+
+PHONE, BIRTHDAY = "11987654321", "1990-01-31"
+
+
+@pytest.fixture
+def identify_calls(monkeypatch):
+    calls = []
+
+    async def identify_user(phone, birthday):
+        calls.append(phone)
+        raise klingo.KlingoError(404, "paciente não encontrado")
+
+    async def no_db(*args):
+        raise ConnectionError("sem banco nos testes")
+
+    monkeypatch.setattr(klingo, "identify_user", identify_user)
+    monkeypatch.setattr(appointments, "_claim", no_db)
+    patients._identify_tasks.clear()
+    patients._tokens.clear()
+    appointments._done.clear()
+    appointments._uncertain.clear()
+    return calls
+
+
+async def _turns(state: AgentVars, *texts: str) -> None:
+    for text in texts:
+        await agent_module.agent_controller(state, text)
+    await asyncio.sleep(0)  # deixa rodar o que os hooks dispararam
+
+
+def test_unregistered_patient_is_identified_once(identify_calls):
+    state = AgentVars()
+    state.current_step = Step.ASK_IDENTIFY
+    asyncio.run(_turns(state, f"{PHONE} 31/01/1990", "Maria da Silva"))
+    assert state.current_step == Step.ASK_REGISTER
+    assert len(identify_calls) == 1
+
+
+def test_expired_token_starts_identification_again(monkeypatch, identify_calls):
+    async def create(token, slot_id):
+        raise klingo.KlingoError(401, "token expirado")
+
+    monkeypatch.setattr(klingo, "create_appointment", create)
+    state = AgentVars()
+    state.current_step = Step.ASK_CONFIRM_APPOINTMENT
+    state.user_phone, state.user_birthday_date = PHONE, BIRTHDAY
+    state.user_token, state.appoitment_id = "tok", "1-0900"
+    asyncio.run(_turns(state, "sim"))
+    assert state.current_step == Step.ASK_IDENTIFY
+    assert len(identify_calls) == 1
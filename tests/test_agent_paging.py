@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from app.agent import agenda
+from app.agent import agent as agent_module
+from app.agent.state import AgentVars, Step
+from app.config import settings
+from app.services import klingo
+
+# 8 datas úteis (sem domingos/feriados) -> páginas [08-10], [11-13], [15-16]
+DATES = ["2030-04-08", "2030-04-09", "2030-04-10", "2030-04-11",
+         "2030-04-12", "2030-04-13", "2030-04-15", "2030-04-16"]
+PAYLOAD = {"horarios": [
+    {"data": d, "profissional": {"id": 1, "nome": "Dra. Márcia Souza"}, "horarios": {f"1-{d}": "09:00"}}
+    for d in DATES
+]}
+
+
+@pytest.fixture
+def talk(monkeypatch):
+    async def get_agenda(*args):
+        return PAYLOAD
+
+    monkeypatch.setattr(klingo, "get_agenda", get_agenda)
+    monkeypatch.setattr(settings, "agenda_full_horizon", True)
+    agenda._agenda_cache.clear()
+    agenda._last_good.clear()
+    agenda._stores.clear()
+    state = AgentVars()
+
+    def send(*messages):
+        async def run():
+            return [await agent_module.agent_controller(state, m) for m in messages]
+        return asyncio.run(run())[-1]
+
+    return state, send
+
+
+def test_more_dates_from_time_step_continues_after_chosen_date(talk):
+    state, send = talk
+    send("oi", "dra marcia", "outras datas", "outras datas")
+    assert state.dates_offset == 6
+    send("08/04/2030")  # data da primeira página
+    assert state.current_step == Step.ASK_TIME
+    reply = send("outras datas")
+    assert "11/04/2030" in reply and "15/04/2030" not in reply
+
+
+def test_more_dates_wraps_to_first_page(talk):
+    state, send = talk
+    reply = send("oi", "dra marcia", "outras datas", "outras datas", "outras datas")
+    assert "voltando às primeiras" in reply
+    assert "08/04/2030" in reply
+    assert "11/04/2030" in send("outras datas")
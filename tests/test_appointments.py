@@ -0,0 +1,129 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services import appointments, klingo
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Sem banco: _claim falha e a deduplicação fica só em memória."""
+    made = []
+
+    async def no_db(*args):
+        raise ConnectionError("sem banco nos testes")
+
+    monkeypatch.setattr(appointments, "_claim", no_db)
+    monkeypatch.setattr(appointments, "_done", {})
+    monkeypatch.setattr(appointments, "_uncertain", {})
+    return made
+
+
+def _stub(monkeypatch, made, exc=None):
+    async def create(token, slot_id):
+        made.append(slot_id)
+        if exc is not None:
+            raise exc
+        return {"id": len(made)}
+
+    monkeypatch.setattr(klingo, "create_appointment", create)
+
+
+def _klingo_error(status, cause=None):
+    err = klingo.KlingoError(status, "x")
+    err.__cause__ = cause
+    return err
+
+
+def test_ambiguous_timeout_is_not_retried(monkeypatch, calls):
+    _stub(monkeypatch, calls, _klingo_error(504, httpx.ReadTimeout("lento")))
+    with pytest.raises(klingo.KlingoError):
+        asyncio.run(appointments.create_appointment_once("tok", "s1"))
+    with pytest.raises(appointments.BookingInProgress):
+        asyncio.run(appointments.create_appointment_once("tok", "s1"))
+    assert calls == ["s1"]
+
+
+@pytest.mark.parametrize("error", [
+    _klingo_error(409),
+    _klingo_error(502, httpx.ConnectError("recusada")),
+])
+def test_definite_failure_allows_retry(monkeypatch, calls, error):
+    _stub(monkeypatch, calls, error)
+    with pytest.raises(klingo.KlingoError):
+        asyncio.run(appointments.create_appointment_once("tok", "s1"))
+    _stub(monkeypatch, calls)
+    assert asyncio.run(appointments.create_appointment_once("tok", "s1")) == {"id": 2}
+
+
+def test_duplicates_share_one_call(monkeypatch, calls):
+    _stub(monkeypatch, calls)
+
+    async def run():
+        return await asyncio.gather(*[appointments.create_appointment_once("tok", "s1") for _ in range(3)])
+
+    assert asyncio.run(run()) == [{"id": 1}] * 3
+    assert calls == ["s1"]
+
+
+def test_slow_database_falls_back_to_memory(monkeypatch):
+    monkeypatch.setattr(appointments.settings, "booking_db_timeout_seconds", 0.05)
+    monkeypatch.setattr(appointments, "_done", {})
+    monkeypatch.setattr(appointments, "_uncertain", {})
+
+    async def hung(*args):
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(appointments, "_claim", hung)
+    monkeypatch.setattr(appointments, "_complete", hung)
+    made = []
+    _stub(monkeypatch, made)
+
+    async def run():
+        return await asyncio.wait_for(appointments.create_appointment_once("tok", "s9"), 1.0)
+
+    assert asyncio.run(run()) == {"id": 1}
+
+
+def test_stale_pending_row_is_taken_over_by_one_process(tmp_path, monkeypatch):
+    from datetime import datetime, timedelta
+
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from app.db.models import Base, BookingRequest
+
+    readers = []
+
+    class RacingSession(AsyncSession):
+        async def scalar(self, *args, **kwargs):
+            row = await super().scalar(*args, **kwargs)
+            # dois processos leem a mesma reserva vencida antes de qualquer um assumir
+            readers.append(row)
+            while len(readers) < 2:
+                await asyncio.sleep(0.001)
+            return row
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'booking.db'}")
+    monkeypatch.setattr(
+        appointments, "AsyncSessionLocal",
+        sessionmaker(engine, class_=RacingSession, expire_on_commit=False),
+    )
+    stale = datetime.utcnow() - timedelta(days=1)
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with AsyncSession(engine) as session:
+            session.add(BookingRequest(
+                idempotency_key="k", slot_id="1-0900", status="pending",
+                created_at=stale, updated_at=stale,
+            ))
+            await session.commit()
+        results = await asyncio.gather(*(appointments._claim("k", "1-0900") for _ in range(2)))
+        await engine.dispose()
+        return results
+
+    results = asyncio.run(run())
+    assert sorted(claimed for claimed, _ in results) == [False, True]
@@ -0,0 +1,28 @@
+import pytest
+
+from app.utils.filters import filter_slots
+from filters_reference import filter_slots_reference, synthetic_payload
+
+LIMITS = [
+    {},
+    {"max_dates": 1, "max_times": 1},
+    {"max_dates": None, "max_times": None},
+]
+
+
+@pytest.mark.parametrize("limits", LIMITS)
+@pytest.mark.parametrize("seed", range(50))
+def test_matches_reference_implementation(seed, limits):
+    payload = synthetic_payload(200 + seed * 20, seed=seed, doctors=1 + seed % 12, days=10 + seed)
+    assert filter_slots(payload, **limits) == filter_slots_reference(payload, **limits)
+
+
+def test_skips_blocked_and_empty_dates():
+    payload = {"horarios": [
+        {"data": "2030-04-14", "profissional": {"id": 1, "nome": "A"}, "horarios": {"a": "08:00"}},  # domingo
+        {"data": "2030-04-19", "profissional": {"id": 1, "nome": "A"}, "horarios": {"b": "08:00"}},  # Sexta Santa
+        {"data": "2030-04-15", "profissional": {"id": 1, "nome": "A"}, "horarios": {}},
+        {"data": "2030-04-16", "profissional": {"id": 1, "nome": "A"}, "horarios": {"c": "09:00"}},
+    ]}
+    dates = filter_slots(payload)["doctors"]["1"]["dates"]
+    assert dates == [{"date": "2030-04-16", "times": [{"slot_id": "c", "time": "09:00"}]}]
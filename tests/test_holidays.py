@@ -0,0 +1,43 @@
+from datetime import date
+
+import pytest
+
+from app.utils.holidays import HolidayCalendar, br_holidays, easter_sunday
+
+
+@pytest.mark.parametrize("year, easter", [
+    (2024, date(2024, 3, 31)),
+    (2025, date(2025, 4, 20)),
+    (2026, date(2026, 4, 5)),
+    (2038, date(2038, 4, 25)),
+])
+def test_easter_sunday(year, easter):
+    assert easter_sunday(year) == easter
+
+
+def test_movable_holidays_follow_easter():
+    holidays = br_holidays(2025)
+    assert holidays[date(2025, 3, 3)] == "Carnaval (segunda-feira)"
+    assert holidays[date(2025, 3, 4)] == "Carnaval (terça-feira)"
+    assert holidays[date(2025, 4, 18)] == "Sexta-feira Santa"
+    assert holidays[date(2025, 6, 19)] == "Corpus Christi"
+
+
+def test_fixed_and_new_national_holidays():
+    assert date(2026, 4, 21) in br_holidays(2026)
+    assert date(2024, 11, 20) in br_holidays(2024)
+    assert date(2023, 11, 20) not in br_holidays(2023)
+
+
+def test_calendar_covers_any_year():
+    calendar = HolidayCalendar()
+    assert "2031-12-25" in calendar
+    assert "2031-12-26" not in calendar
+
+
+def test_recurring_and_one_off_closures():
+    calendar = HolidayCalendar(["07-09", " 2026-08-14 ", "02-29"])
+    assert "2026-07-09" in calendar and "2031-07-09" in calendar
+    assert "2026-08-14" in calendar and "2027-08-14" not in calendar
+    assert "2028-02-29" in calendar
+    assert "2027-02-28" not in calendar and "2027-03-01" not in calendar  # 02-29 em ano comum
@@ -0,0 +1,41 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.llm.adapter import LLMAdapter
+
+
+def _chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeCompletions:
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.kwargs = None
+
+    async def create(self, **kwargs):
+        self.kwargs = kwargs
+
+        async def stream():
+            for text in self.deltas:
+                yield _chunk(text)
+
+        return stream()
+
+
+def _adapter(completions) -> LLMAdapter:
+    adapter = LLMAdapter.__new__(LLMAdapter)
+    adapter.model, adapter._mode, adapter._pai = "test-model", "openai", None
+    adapter._openai = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return adapter
+
+
+def test_stream_text_yields_deltas_as_they_arrive():
+    completions = FakeCompletions(["Olá", "", None, ", tudo", " bem?"])
+
+    async def run():
+        return [d async for d in _adapter(completions).stream_text("sistema", "oi")]
+
+    assert asyncio.run(run()) == ["Olá", ", tudo", " bem?"]
+    assert completions.kwargs["stream"] is True
+    assert completions.kwargs["messages"][0] == {"role": "system", "content": "sistema"}
@@ -0,0 +1,61 @@
+import pytest
+
+from app.utils.matcher import DoctorMatcher, fold
+
+DOCTORS = {
+    "1": "Dra. Márcia Souza",
+    "2": "Dr. João Pedro Lima",
+    "3": "Dr. João Carvalho",
+    "4": "Dra. Ana Lima",
+    "5": "Dra. Ana Lima Souza",
+}
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return DoctorMatcher(DOCTORS, min_similarity=0.75)
+
+
+def test_fold():
+    assert fold("Dra. Márcia  SOUZA!") == "dra marcia souza"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("dra marcia", "1"),
+    ("Quero a Dra. Márcia, por favor", "1"),
+    ("joao pedro lima", "2"),
+    ("dr carvalho", "3"),
+])
+def test_exact_mentions(matcher, text, expected):
+    assert matcher.match(text) == expected
+
+
+def test_longest_full_name_wins(matcher):
+    assert matcher.match("ana lima souza") == "5"
+    assert matcher.match("ana lima") == "4"
+
+
+def test_tie_between_doctors_is_ambiguous(matcher):
+    assert matcher.candidates("dr joao") == ["2", "3"]
+    assert matcher.match("dr joao") is None
+
+
+def test_no_name_no_match(matcher):
+    assert matcher.match("tanto faz") is None
+    assert matcher.candidates("") == []
+
+
+def test_typo_matches_closest_name(matcher):
+    assert matcher.match("dra marsia") == "1"
+    assert matcher.match("carvalio") == "3"
+
+
+@pytest.mark.parametrize("text", ["quero consulta", "prefiro outro medico", "pode ser com essa"])
+def test_common_words_never_match(matcher, text):
+    assert matcher.candidates(text) == []
+
+
+def test_similarity_threshold():
+    strict = DoctorMatcher(DOCTORS, min_similarity=0.95)
+    assert strict.match("marsia") is None
+    assert DoctorMatcher(DOCTORS, min_similarity=0.8).match("marsia") == "1"
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+
+from app.utils import metrics
+
+
+def test_scrape_endpoint_serves_prometheus_text():
+    metrics.histogram("otinho_test_seconds", "teste", step="a").observe(0.02)
+
+    async def run():
+        await metrics.start_exporters("127.0.0.1", 0, 0)
+        port = metrics._exporters[0].sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: x\r\n\r\n")
+            response = await reader.read()
+            writer.close()
+            return response.decode()
+        finally:
+            await metrics.stop_exporters()
+
+    response = asyncio.run(run())
+    assert response.startswith("HTTP/1.1 200")
+    assert 'otinho_test_seconds_bucket{step="a",le="0.025"} 1' in response
+
+
+def test_periodic_snapshot_is_logged(caplog):
+    metrics.counter("otinho_test_total", "teste").inc()
+    metrics.logger.addHandler(caplog.handler)
+
+    async def run():
+        await metrics.start_exporters("127.0.0.1", None, 0.01)
+        await asyncio.sleep(0.05)
+        await metrics.stop_exporters()
+
+    try:
+        with caplog.at_level(logging.INFO, logger="otinho.metrics"):
+            asyncio.run(run())
+    finally:
+        metrics.logger.removeHandler(caplog.handler)
+    assert any('"metric": "otinho_test_total"' in r.getMessage() for r in caplog.records)
+
+
+def test_port_in_use_does_not_stop_the_worker():
+    async def run():
+        other = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+        port = other.sockets[0].getsockname()[1]
+        try:
+            await metrics.start_exporters("127.0.0.1", port, 0)  # segundo worker no host
+            return list(metrics._exporters)
+        finally:
+            await metrics.stop_exporters()
+            other.close()
+            await other.wait_closed()
+
+    assert asyncio.run(run()) == []
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from app.agent import nlu
+from app.config import settings
+
+
+class RecordingLLM:
+    def __init__(self):
+        self.prompts = []
+
+    async def ask_json(self, system, text, schema):
+        self.prompts.append((system, text))
+        return schema()
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    fake = RecordingLLM()
+    monkeypatch.setattr(nlu, "_adapter", fake)
+    monkeypatch.setattr(settings, "nlu_llm_enabled", True)
+    return fake
+
+
+def test_system_prompts_do_not_vary_per_turn(llm):
+    async def run():
+        await nlu.llm_date("amanhã", ["2030-04-09", "2030-04-10"])
+        await nlu.llm_date("quarta", ["2030-05-01"])
+        await nlu.llm_time("às 9", ["09:00"])
+        await nlu.llm_time("o primeiro", ["10:00", "10:30"])
+        await nlu.llm_doctor("a doutora", {"1": "Dra. A"})
+        await nlu.llm_doctor("o doutor", {"2": "Dr. B", "3": "Dr. C"})
+
+    asyncio.run(run())
+    systems = [system for system, _ in llm.prompts]
+    assert len(set(systems)) == 3
+    assert "2030-05-01" in llm.prompts[1][1] and "Dr. C" in llm.prompts[5][1]
+
+
+def test_regex_hit_never_calls_llm(llm):
+    value = asyncio.run(nlu.tiered("time", "09:00", lambda t: t, lambda t: nlu.llm_time(t, [])))
+    assert value == "09:00" and llm.prompts == []
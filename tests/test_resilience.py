@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from app.services.resilience import (
+    BudgetExceeded,
+    CircuitBreaker,
+    CircuitOpenError,
+    resilient_call,
+    turn_budget,
+)
+
+
+def _half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=0.0)
+    breaker.record_failure()
+    assert breaker.state == "half-open"
+    return breaker
+
+
+async def _ok(timeout: float) -> str:
+    return "ok"
+
+
+def _call(breaker: CircuitBreaker, fn=_ok):
+    return resilient_call(fn, breaker=breaker, idempotent=True, is_failure=lambda e: False, attempts=1)
+
+
+def test_budget_exhausted_does_not_hold_half_open_probe():
+    breaker = _half_open_breaker()
+
+    async def run():
+        with turn_budget(0):
+            with pytest.raises(BudgetExceeded):
+                await _call(breaker)
+        assert await _call(breaker) == "ok"
+
+    asyncio.run(run())
+    assert breaker.state == "closed"
+
+
+def test_cancelled_probe_is_released():
+    breaker = _half_open_breaker()
+
+    async def slow(timeout: float) -> str:
+        await asyncio.sleep(10)
+        return "late"
+
+    async def run():
+        task = asyncio.create_task(_call(breaker, slow))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert await _call(breaker) == "ok"
+
+    asyncio.run(run())
+    assert breaker.state == "closed"
+
+
+def test_open_breaker_rejects_until_reset():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=60.0)
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(_call(breaker))